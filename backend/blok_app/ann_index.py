@@ -0,0 +1,167 @@
+"""
+    Choice and tuning of the FAISS index of a collection. Chunk embeddings are L2-normalized, so that inner product
+    is cosine similarity:
+
+        flat     exact search (IndexFlatIP), while its estimated latency is within RAG["SEARCH_LATENCY_MS"]
+        hnsw     graph index (IndexHNSWFlat), for collections too large for exact search
+        ivfpq    inverted lists of compressed vectors (IndexIVFPQ), from RAG["IVFPQ_MIN_CHUNKS"] chunks on
+
+    Approximate indexes get the smallest efSearch/nprobe reaching RAG["ANN_RECALL"] against exact search.
+    The exact search latency is estimated from the number of vectors, their dimension and the configured cost of
+    scanning one value (RAG["FLAT_SCAN_NS"]), so a collection always gets the same index on any machine or load.
+    The measured latencies are recorded in the parameters, to calibrate FLAT_SCAN_NS against.
+    The chosen parameters are returned as a dict, to be persisted with the index and applied again on reload.
+"""
+from backend.config import RAG
+
+import logging
+import math
+import time
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = (16, 32, 64, 128, 256, 512)
+PQ_NBITS = 8
+PQ_MIN_CHUNKS = 10000  # fewer vectors cannot train the PQ codebooks and inverted lists well: HNSW is used instead
+TRAINING_VECTORS_PER_LIST = 64
+TUNING_QUERIES = 64
+LATENCY_QUERIES = 16
+
+def normalize(matrix):
+    """
+    L2-normalized float32 copy of an embedding matrix.
+    """
+    matrix = np.array(matrix, dtype=np.float32)
+    faiss.normalize_L2(matrix)
+    return matrix
+
+def _tuning_queries(flat):
+    """
+    Query vectors for tuning: normalized midpoints of random pairs of indexed vectors.
+    """
+    rng = np.random.default_rng(0)
+    a = flat.reconstruct_batch(rng.integers(0, flat.ntotal, TUNING_QUERIES))
+    b = flat.reconstruct_batch(rng.integers(0, flat.ntotal, TUNING_QUERIES))
+    return normalize(a + b)
+
+def _latency_ms(index, queries, k):
+    """
+    Mean latency of single-query searches (as run by the retriever; batches would be faster per query).
+    """
+    queries = queries[:LATENCY_QUERIES]
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query[None, :], k)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+def flat_latency_ms(n, d):
+    """
+    Estimated latency of an exact search over n vectors of dimension d (its cost grows with the values scanned).
+    """
+    return n * d * RAG["FLAT_SCAN_NS"] / 1e6
+
+def _recall(index, queries, truth, k):
+    _, found = index.search(queries, k)
+    return float(np.mean([ len(set(f) & set(t)) / k for f, t in zip(found, truth) ]))
+
+def _tune(index, param, values, queries, truth, k):
+    """
+    Set the smallest value of the search parameter that reaches the recall target (or the largest one).
+    """
+    space = faiss.ParameterSpace()
+    for value in values:
+        space.set_index_parameter(index, param, value)
+        recall = _recall(index, queries, truth, k)
+        if recall >= RAG["ANN_RECALL"]:
+            break
+    return value, recall
+
+def _build_hnsw(vectors, queries, truth, k):
+    index = faiss.IndexHNSWFlat(vectors.shape[1], HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.add(vectors)
+    ef_search, recall = _tune(index, "efSearch", [ ef for ef in HNSW_EF_SEARCH if ef >= k ] or [k], queries, truth, k)
+    params = {
+        "type": "hnsw",
+        "M": HNSW_M,
+        "efConstruction": HNSW_EF_CONSTRUCTION,
+        "efSearch": ef_search,
+        "recall": recall,
+        "bytes_per_vector": vectors.shape[1] * 4 + HNSW_M * 2 * 4,
+    }
+    return index, params
+
+def _build_ivfpq(vectors, queries, truth, k):
+    n, d = vectors.shape
+    nlist = 2 ** round(math.log2(4 * math.sqrt(n)))
+    m = next( m for m in range(max(1, d // 8), 0, -1) if d % m == 0 )  # sub-quantizers must divide the dimension
+    quantizer = faiss.IndexFlatIP(d)
+    index = faiss.IndexIVFPQ(quantizer, d, nlist, m, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+    rng = np.random.default_rng(0)
+    index.train(vectors[rng.choice(n, min(n, nlist * TRAINING_VECTORS_PER_LIST), replace=False)])
+    index.add(vectors)
+    nprobes = [ 2 ** i for i in range(int(math.log2(nlist)) + 1) ]
+    nprobe, recall = _tune(index, "nprobe", nprobes, queries, truth, k)
+    params = {
+        "type": "ivfpq",
+        "nlist": nlist,
+        "m": m,
+        "nbits": PQ_NBITS,
+        "nprobe": nprobe,
+        "recall": recall,
+        "bytes_per_vector": m * PQ_NBITS // 8 + 8,
+    }
+    return index, params
+
+def build(flat, k):
+    """
+    Pick the index for the normalized vectors of an exact IndexFlatIP, searched for the top k.
+    Returns (index, params); the flat index itself is returned when exact search is fast enough (or configured).
+    """
+    n, d = flat.ntotal, flat.d
+    k = min(k, n)
+    queries = _tuning_queries(flat)
+    latency = _latency_ms(flat, queries, k)
+    index_type = RAG["INDEX_TYPE"]
+    if index_type == "auto":
+        if flat_latency_ms(n, d) <= RAG["SEARCH_LATENCY_MS"]:
+            index_type = "flat"
+        elif n < RAG["IVFPQ_MIN_CHUNKS"]:
+            index_type = "hnsw"
+        else:
+            index_type = "ivfpq"
+    if index_type == "ivfpq" and n < PQ_MIN_CHUNKS:
+        index_type = "hnsw"
+
+    if index_type == "flat":
+        return flat, {"type": "flat", "latency_ms": latency, "estimated_latency_ms": flat_latency_ms(n, d), "bytes_per_vector": d * 4}
+
+    start = time.perf_counter()
+    _, truth = flat.search(queries, k)
+    vectors = flat.reconstruct_n(0, n)
+    if index_type == "hnsw":
+        index, params = _build_hnsw(vectors, queries, truth, k)
+    else:
+        index, params = _build_ivfpq(vectors, queries, truth, k)
+    params["latency_ms"] = _latency_ms(index, queries, k)
+    params["exact_latency_ms"] = latency
+    params["estimated_exact_latency_ms"] = flat_latency_ms(n, d)
+    logger.info(
+        f"Built {index_type} index of {n} chunks in {time.perf_counter() - start:.1f}s: "
+        f"{params['latency_ms']:.2f} ms/query (exact: {latency:.2f} ms), recall@{k} {params['recall']:.3f}"
+    )
+    return index, params
+
+def set_search_params(index, params):
+    """
+    Apply the recorded search parameters (efSearch/nprobe) to a reloaded index.
+    """
+    space = faiss.ParameterSpace()
+    for param in ("efSearch", "nprobe"):
+        if param in params:
+            space.set_index_parameter(index, param, params[param])
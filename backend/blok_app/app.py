@@ -1,7 +1,12 @@
 import logging
 import backend.blok_app.db as db
+import backend.blok_app.db_async as db_async
+import backend.blok_app.db_metrics as db_metrics
 import asyncio
+import contextlib
 import os
+import re
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
 from typing import List
@@ -20,11 +25,15 @@ from backend.config import PORT, RAG, TTS
 import backend.blok_app.tasks as tasks
 import backend.blok_app.customization_config as custom
 from backend.blok_app.customization_config import CustomizationConfig
-from backend.blok_app.resource_generation import generate_headings
 
 from backend.blok_app.llm_factory import load_llm
 import backend.blok_app.rag as rag
+import backend.blok_app.ingestion as ingestion
+import backend.blok_app.uploads as uploads
 import backend.blok_app.audio_process as audio_process
+import backend.blok_app.document_parser_backend_ocr as document_parser
+import backend.blok_app.parse_cache as parse_cache
+import backend.blok_app.office_converter as office_converter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -39,7 +48,7 @@ Extend(app, config={
 })
 
 
-app.config.REQUEST_MAX_SIZE = 1.5 * 1000 * 1024 * 1024  # 1 GB
+app.config.REQUEST_MAX_SIZE = 1.5 * 1000 * 1024 * 1024  # 1 GB (uploads are streamed to disk, see uploads.py)
 app.config.RESPONSE_TIMEOUT = 300  # 5 min
 log = logging.getLogger(__name__)   # <-- use this logger
 #ASR_MODEL_PATH_EU = "/mnt/nfs/proiektuak/bloklm/ereduak/stt_eu_conformer_transducer_large/stt_eu_conformer_transducer_large.nemo"
@@ -60,14 +69,40 @@ async def worker():
             await loop.run_in_executor(executor, func, *args)
         except Exception as e:
             logging.error(f"Error in task {func.__name__}: {e}")
-            db.fail_note(args[2])  # args[2]: note_id
+            await db_async.fail_note(args[2])  # args[2]: note_id
         finally:
             task_queue.task_done()
 
+_rag_load_locks = {}
+
 def ensure_collection_rag_loaded(collection_id):
-    if collection_id not in rag.collection_graphs:
-        docs = db.retrieve_collection_documents(collection_id)
-        rag.init_collection_graph(collection_id, docs)
+    """
+    The RAG graph of the collection, loading it if needed. Use the returned graph rather than looking it up
+    again: it may be evicted from the cache by another collection in between.
+    """
+    # One lock per collection, so that concurrent first queries load it only once
+    with _rag_load_locks.setdefault(collection_id, threading.Lock()):
+        graph = rag.get_graph(collection_id)
+        if graph is None:
+            graph = rag.init_collection_graph(
+                collection_id, db.iter_collection_documents(collection_id), db.get_chunk_set_version(collection_id),
+            )
+        return graph
+
+def chat_session(session):
+    """
+    Validate the conversation id sent by the client (one per browser, see frontend chat service).
+    """
+    session = session or rag.DEFAULT_SESSION
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", session):
+        raise BadRequest("Invalid chat session")
+    return session
+
+async def load_collection_rag(collection_id):
+    """
+    ensure_collection_rag_loaded in a thread: loading reads the DB and may build the index.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, ensure_collection_rag_loaded, collection_id)
 
 @app.listener("before_server_start")
 async def start_worker(app, _):
@@ -111,6 +146,25 @@ async def setup_llm(app, _):
     # Add LLM to audio processing module
     audio_process._llm = llm
     
+@app.listener("before_server_start")
+async def warm_document_converters(app, _):
+    # Load the Docling layout/OCR/table models once, instead of on the first upload
+    await asyncio.get_running_loop().run_in_executor(None, document_parser.warm_converters)
+
+@app.listener("after_server_stop")
+async def stop_document_converters(app, _):
+    document_parser.shutdown_process_pool()
+    office_converter.shutdown()
+
+@app.listener("before_server_start")
+async def open_db_async_pool(app, _):
+    await db_async.init_pool()
+
+@app.listener("after_server_stop")
+async def close_db_pool(app, _):
+    await db_async.close_pool()
+    db.close_pool()
+
 @app.listener("before_server_start")
 async def setup_tts_listener(app, loop):
     # Add TTS path to LD_LIBRARY_PATH (required by ahotts)
@@ -122,7 +176,7 @@ async def setup_tts_listener(app, loop):
 @app.get("/api/bildumak")
 async def get_bildumak(request):
     print("Received request to /api/bildumak:", str(request))
-    results = db.get_bildumak()
+    results = await db_async.get_bildumak(request.args.get("after"), request.args.get("limit"))
     return json(results)
 
 @app.get("/api/bilduma")
@@ -130,7 +184,7 @@ async def get_bilduma(request):
     print("Received request to /api/bilduma:", str(request))
     id = request.args.get("id") 
 
-    results = db.get_bilduma(id)
+    results = await db_async.get_bilduma(id)
     return json(results)
 
 @app.post("/api/sortu_bilduma")
@@ -138,7 +192,7 @@ async def sortu_bilduma(request):
     print("Received request to /api/sortu_bilduma:", str(request))
     payload = request.json
 
-    db.create_bilduma(payload)
+    await db_async.create_bilduma(payload)
 
     return json({id:payload['id']})
     
@@ -147,8 +201,8 @@ async def ezabatu_bilduma(request):
     print("Received request to /api/ezabatu_bilduma:", str(request))
     payload = request.json
 
-    db.delete_bilduma(payload)
-    rag.reset_chat(payload['id'])
+    await db_async.delete_bilduma(payload)
+    await asyncio.get_running_loop().run_in_executor(None, rag.drop_collection, int(payload['id']))
 
     return json({id:payload['id']})
     
@@ -157,7 +211,7 @@ async def berrizendatu_bilduma(request):
     print("Received request to /api/berrizendatu_bilduma:", str(request))
     payload = request.json
 
-    db.rename_bilduma(payload)
+    await db_async.rename_bilduma(payload)
 
     return json({id:payload['id']})
 
@@ -170,7 +224,7 @@ async def berrizendatu_bilduma(request):
 async def get_fitxategiak(request):
     print("Received request to /api/fitxategiak:", str(request))
     id = request.args.get("id")
-    results = db.get_fitxategiak(id)
+    results = await db_async.get_fitxategiak(id)
     return json(results)
 
 @app.get("/api/fitxategia")
@@ -178,49 +232,43 @@ async def get_fitxategia(request):
     print("Received request to /api/fitxategia:", str(request))
     id = request.args.get("id")
 
-    results = db.get_fitxategia(id)
+    results = await db_async.get_fitxategia(id)
     return json(results)
 
-@app.post("/api/igo_fitxategiak")
-def upload_fitxategiak(request):
+@app.post("/api/igo_fitxategiak", stream=True)
+async def upload_fitxategiak(request):
     print("Received request to /api/igo_fitxategiak:", str(request))
 
-    nt_id = request.form.get("nt_id")
-    files = request.files.getlist("files")
+    # Files are spooled to disk while the body streams in, instead of being held in memory
+    form, uploaded = await uploads.receive_multipart(request)
+    nt_id = form.get("nt_id")
+    files = uploaded.get("files", [])
 
     if not nt_id or not files:
+        for field_files in uploaded.values():
+            uploads.cleanup(field_files)
         raise BadRequest("nt_id and at least one file are required")
     print('Notebook id: ', nt_id, '\nFiles: ')
     for f in files: print(f.name) 
-    parsed_files = db.upload_fitxategiak(nt_id, files)
 
-    # index by RAG engine
-    # rag_docs = []
-    # for uploaded_file in parsed_files:
-    #     fname = uploaded_file['filename']
-    #     rag_docs.append(Document(uploaded_file['text'], 'eu', fname, path=fname, collection=nt_id))
-    # rag.add_document_batch(rag_docs)
+    # parse, store, index and generate the collection-level title and summary in the background
+    job = ingestion.submit(llm, nt_id, files)
 
-    # generate collection-level title and summary
-    files = db.get_fitxategiak(nt_id, content=True)
-    fids, contents = zip(*[ (f["id"], f["text"]) for f in files ])
-    docs = rag.split_and_vectorize(fids, contents)
-    db.store_documents(docs)
+    return json({"job_id": job.id, "status": job.status}, status=202)
 
-    file_ids = [ f['id'] for f in files ]
-    file_ids_ordered = [f['id'] for f in sorted(files, key=lambda d: d['name'].lower())]
-
-    name, title, summary = generate_headings(llm, db, nt_id, file_ids)
-    db.set_descriptors_to_bilduma(nt_id, name, title, summary)
-
-    return json({"id": nt_id, "title": name, "description": title, "summary": summary, "file_ids": file_ids_ordered, "status": "ok"})
+@app.get("/api/ingestion_job")
+async def get_ingestion_job(request):
+    job = ingestion.get_job(request.args.get("id"))
+    if job is None:
+        return json({}, status=404)
+    return json(job.to_dict())
 
 @app.get("/api/chunk")
 async def get_chunk(request):
     print("Received request to /api/chunk:", str(request))
     cid = request.args.get("id")
     print('ID of the chunk', cid)
-    chunk = db.get_document(cid)
+    chunk = await db_async.get_document(cid)
     print('Chunk: ', chunk)
     return json(chunk)
 
@@ -240,7 +288,7 @@ async def create_chat(request):
         raise Exception(error_msg)
     
     try:
-        db.set_chat_id(id, chat_id)
+        await db_async.set_chat_id(id, chat_id)
         return json({"chat_id": chat_id, 'error': ''})
     except Exception as e:
         error_msg = 'Error while setting chat id in bilduma: ' + str(e)
@@ -249,8 +297,9 @@ async def create_chat(request):
 @app.get("/api/delete_chat")
 async def delete_chat(request):
     id = int(request.args.get("nt_id"))
+    session = chat_session(request.args.get("session"))
     try:
-        rag.reset_chat(id)
+        await asyncio.get_running_loop().run_in_executor(None, rag.reset_chat, id, session)
         return json({"chat_id": id, 'ok': True})
     except Exception as e:
         error_msg = 'Error while setting chat id in bilduma: ' + str(e)
@@ -259,16 +308,17 @@ async def delete_chat(request):
 @app.get("/api/get_chat")
 async def get_chat(request):
     nt_id = int(request.args.get("nt_id"))
-    ensure_collection_rag_loaded(nt_id)
+    session = chat_session(request.args.get("session"))
+    graph = await load_collection_rag(nt_id)
 
     try:
-        print(rag.chat_history(nt_id))
-
+        # Reading the checkpoint is SQLite I/O: off the event loop, as the loading
+        history = await asyncio.get_running_loop().run_in_executor(None, rag.chat_history, nt_id, graph, session)
         chat_hist = [
             {'role': 'assistant', 'content': message['content']}
             if message['role'].lower() == 'ai' 
             else {'role': 'user', 'content': message['content']}
-            for message in rag.chat_history(nt_id)
+            for message in history
             if message['role'].lower() in ('ai', 'human') and message['content']
         ]
 
@@ -281,14 +331,17 @@ async def get_chat(request):
 class QueryModel(BaseModel):
     query: str
     collection: int
+    session: str = rag.DEFAULT_SESSION
 
 @app.post("/api/query")
 @validate(json=QueryModel)
 async def rag_query(request, body: QueryModel):
-    ensure_collection_rag_loaded(body.collection)
+    session = chat_session(body.session)
+    # Loaded before responding, so that a missing or empty collection fails with an error status
+    graph = await load_collection_rag(body.collection)
     
     # response = await request.respond(content_type="text/plain")
-    # async for token in rag.query(body.query, body.collection):
+    # async for token in rag.query(body.query, body.collection, graph, session):
     #     await response.send(token)
     # await response.send("\n")
     # await response.eof()
@@ -300,18 +353,19 @@ async def rag_query(request, body: QueryModel):
             'X-Accel-Buffering': 'no'
         }
     )
-    async for token in rag.query(body.query, body.collection):
-        # Format as SSE with JSON payload
-        sse_data = p_json.dumps({
-            'choices': [{
-                'delta': {
-                    'content': str(token)
-                }
-            }]
-        })
-        print(sse_data)
-        await response.send(f"data: {sse_data}\n\n")
-        await asyncio.sleep(0)
+    # aclosing: if the client disconnects (the send fails or the handler is cancelled), the graph is stopped too
+    async with contextlib.aclosing(rag.query(body.query, body.collection, graph, session)) as tokens:
+        async for token in tokens:
+            # Format as SSE with JSON payload
+            sse_data = p_json.dumps({
+                'choices': [{
+                    'delta': {
+                        'content': str(token)
+                    }
+                }]
+            })
+            print(sse_data)
+            await response.send(f"data: {sse_data}\n\n")
     
     # Send completion signal
     await response.send("data: [DONE]\n\n")
@@ -363,14 +417,14 @@ class PodcastModel(BasicResourceModel):
 @app.get("/api/notes")
 async def get_notes(request):
     id = request.args.get("nt_id")
-    results = db.get_notes(id)
+    results = await db_async.get_notes(id, request.args.get("after"), request.args.get("limit"))
     return json(results)
 
 @app.get("/api/note")
 async def get_note(request):
     note_id = request.args.get("id")
     try:
-        note = db.get_note(note_id)
+        note = await db_async.get_note(note_id)
         if note == False:
             return json({}, status=409)
         elif note is None:
@@ -384,7 +438,7 @@ async def get_note(request):
 async def delete_note(request):
     id = request.args.get("id")
     try:
-        db.ezabatu_nota(id)
+        await db_async.ezabatu_nota(id)
         return json({"note_id": id, 'ok': True})
     except Exception as e:
         error_msg = 'Error while setting note id in bilduma: ' + str(e)
@@ -393,42 +447,42 @@ async def delete_note(request):
 @app.post("/api/summary")
 @validate(json=SummaryModel)
 async def create_summary(request, body: SummaryModel):
-    note_id = db.create_empty_note("summary", body.collection_id, body.file_ids)
+    note_id = await db_async.create_empty_note("summary", body.collection_id, body.file_ids)
     await task_queue.put((tasks.generate_summary_task, (llm, db, note_id, body.collection_id, body.file_ids, body.language, CustomizationConfig.from_sanic_body(body))))
     return json({"id": note_id}, status=202)
 
 @app.post("/api/faq")
 @validate(json=FAQModel)
 async def create_faq(request, body: FAQModel):
-    note_id = db.create_empty_note("FAQ", body.collection_id, body.file_ids)
+    note_id = await db_async.create_empty_note("FAQ", body.collection_id, body.file_ids)
     await task_queue.put((tasks.generate_faq_task, (llm, db, note_id, body.collection_id, body.file_ids, body.language, CustomizationConfig.from_sanic_body(body))))
     return json({"id": note_id}, status=202)
 
 @app.post("/api/outline")
 @validate(json=OutlineModel)
 async def create_outline(request, body: OutlineModel):
-    note_id = db.create_empty_note("outline", body.collection_id, body.file_ids)
+    note_id = await db_async.create_empty_note("outline", body.collection_id, body.file_ids)
     await task_queue.put((tasks.generate_outline_task, (llm, db, note_id, body.collection_id, body.file_ids, body.language, CustomizationConfig.from_sanic_body(body))))
     return json({"id": note_id}, status=202)
 
 @app.post("/api/mindmap")
 @validate(json=MindMapModel)
 async def create_mind_map(request, body: MindMapModel):
-    note_id = db.create_empty_note("mindmap", body.collection_id, body.file_ids)
+    note_id = await db_async.create_empty_note("mindmap", body.collection_id, body.file_ids)
     await task_queue.put((tasks.generate_mind_map_task, (llm, db, note_id, body.collection_id, body.file_ids, body.language, CustomizationConfig.from_sanic_body(body))))
     return json({"id": note_id}, status=202)
 
 @app.post("/api/glossary")
 @validate(json=GlossaryModel)
 async def create_glossary(request, body: GlossaryModel):
-    note_id = db.create_empty_note("glossary", body.collection_id, body.file_ids)
+    note_id = await db_async.create_empty_note("glossary", body.collection_id, body.file_ids)
     await task_queue.put((tasks.generate_glossary_task, (llm, db, note_id, body.collection_id, body.file_ids, body.language, CustomizationConfig.from_sanic_body(body))))
     return json({"id": note_id}, status=202)
 
 @app.post("/api/timeline")
 @validate(json=ChronogramModel)
 async def create_chronogram(request, body: ChronogramModel):
-    note_id = db.create_empty_note("timeline", body.collection_id, body.file_ids)
+    note_id = await db_async.create_empty_note("timeline", body.collection_id, body.file_ids)
     await task_queue.put((tasks.generate_chronogram_task, (llm, db, note_id, body.collection_id, body.file_ids, body.language, CustomizationConfig.from_sanic_body(body))))
     return json({"id": note_id}, status=202)
 
@@ -439,7 +493,7 @@ async def create_chronogram(request, body: ChronogramModel):
 @app.post("/api/podcast")
 @validate(json=PodcastModel)
 async def create_podcast(request, body: PodcastModel):
-    note_id = db.create_empty_note("podcast", body.collection_id, body.file_ids)
+    note_id = await db_async.create_empty_note("podcast", body.collection_id, body.file_ids)
     await task_queue.put((tasks.generate_podcast_task, (llm, db, note_id, body.collection_id, body.file_ids, body.language, CustomizationConfig.from_sanic_body(body))))
     return json({"id": note_id}, status=202)
 
@@ -460,6 +514,24 @@ async def get_podcast(request):
         },
     )
 
+# ------------------------------------------------------------------
+# METRICS
+# ------------------------------------------------------------------
+
+@app.get("/api/metrics")
+async def get_metrics(request):
+    return json({
+        "db_pool": db.pool_metrics(),
+        "db_async_pool": db_async.pool_metrics(),
+        "db_statements": db_metrics.statements(),
+        "db_slow_queries": db_metrics.slow_queries(),
+        "rag_cache": rag.cache_metrics(),
+        "document_converters": document_parser.converter_metrics(),
+        "parse_cache": parse_cache.metrics(),
+        # Pings each LibreOffice instance over UNO: off the event loop
+        "office_converter": await asyncio.get_running_loop().run_in_executor(None, office_converter.health),
+    })
+
 # ------------------------------------------------------------------
 # MAIN
 # ------------------------------------------------------------------
@@ -1,15 +1,20 @@
 from backend.config import ASR
+from backend.blok_app.uploads import file_path
 
 from speechbrain.inference.classifiers import EncoderClassifier
 from langchain.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate
 from pydub import AudioSegment
+from pydub.utils import mediainfo
 import numpy as np
 
 import tempfile
 from pathlib import Path
 import io
+import itertools
+import math
 
 SAMPLE_RATE = 16000
+CHUNK_LENGTH = 30  # seconds
 
 # Global model instances (load once at application startup)
 _asr_model_eu = None
@@ -72,7 +77,6 @@ def convert_audio_to_wav(audio_bytes, source_format):
         audio = audio.set_frame_rate(SAMPLE_RATE).set_channels(1)
 
         # Split audio into chunks
-        CHUNK_LENGTH = 30  # seconds
         chunk_length_ms = CHUNK_LENGTH * 1000
         chunks = [audio[i:i + chunk_length_ms] for i in range(0, len(audio), chunk_length_ms)]
         
@@ -89,6 +93,32 @@ def convert_audio_to_wav(audio_bytes, source_format):
     except Exception as e:
         raise Exception(f"Audio conversion failed: {str(e)}")
     
+def iter_wav_chunks_from_file(audio_path, source_format):
+    """
+    Decode an audio file on disk one 30s chunk at a time, so that memory use does not depend on its duration.
+
+    Yields:
+        WAV audio bytes at 16kHz mono
+    """
+    try:
+        source_format = source_format.lstrip('.')
+        duration = float(mediainfo(str(audio_path))["duration"])
+    except Exception as e:
+        raise Exception(f"Audio conversion failed: {str(e)}")
+    for start in range(0, math.ceil(duration), CHUNK_LENGTH):
+        try:
+            # ffmpeg seeks to the chunk and resamples it to 16kHz mono while decoding
+            chunk = AudioSegment.from_file(
+                str(audio_path), format=source_format, start_second=start, duration=CHUNK_LENGTH,
+                parameters=["-ar", str(SAMPLE_RATE), "-ac", "1"],
+            )
+            chunk = chunk.set_frame_rate(SAMPLE_RATE).set_channels(1)
+            wav_buffer = io.BytesIO()
+            chunk.export(wav_buffer, format='wav')
+        except Exception as e:
+            raise Exception(f"Audio conversion failed: {str(e)}")
+        yield wav_buffer.getvalue()
+
 def _extract_text_from_audio_chunk(wav_bytes, lang):
     # Save converted audio to a temporary WAV file
     with tempfile.NamedTemporaryFile(suffix='.wav') as tmp:
@@ -162,16 +192,22 @@ def extract_text_from_audio(file_obj):
         # Extract basic info
         filename = file_obj.name
         file_type = Path(filename).suffix.lower()  # e.g., '.mp3' or '.wav'
-        audio_bytes = file_obj.body
+        audio_path = file_path(file_obj)
         
-        # Convert audio to required format (16kHz mono WAV)
-        wavs_bytes = convert_audio_to_wav(audio_bytes, file_type)
+        # Convert audio to required format (16kHz mono WAV), chunk by chunk for files spooled to disk
+        if audio_path is not None:
+            wavs_bytes = iter_wav_chunks_from_file(audio_path, file_type)
+        else:
+            wavs_bytes = iter(convert_audio_to_wav(file_obj.body, file_type))
+        first_wav_bytes = next(wavs_bytes, None)
+        if first_wav_bytes is None:
+            raise ValueError("Empty audio file")
         
         # Detect language from the first chunk
-        lang = detect_language_from_array(wavs_bytes[0], SAMPLE_RATE)
+        lang = detect_language_from_array(first_wav_bytes, SAMPLE_RATE)
 
         chunk_texts = []
-        for wav_bytes in wavs_bytes:
+        for wav_bytes in itertools.chain([first_wav_bytes], wavs_bytes):
             chunk_text = _extract_text_from_audio_chunk(wav_bytes, lang)
             chunk_texts.append(chunk_text)
 
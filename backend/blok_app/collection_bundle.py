@@ -0,0 +1,252 @@
+"""
+    Export/import of a collection as a bundle directory, to move it between deployments without parsing and embedding its files again:
+
+        manifest.json      collection metadata, counts, embedding model and dimension
+        files.parquet      extracted texts of the files
+        chunks.parquet     chunk texts and offsets, row i <-> embeddings.npy[i]
+        embeddings.npy     float32 (n_chunks, dim) matrix, memory-mapped on import
+        notes.parquet      generated notes
+        audio/<key>.wav    podcast audios
+"""
+from backend.config import RAG, TTS
+
+import datetime
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import backend.blok_app.ann_index as ann_index
+import backend.blok_app.db as db
+import backend.blok_app.index_store as index_store
+import backend.blok_app.rag as rag
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+
+FILES_SCHEMA = pa.schema([
+    ("file_key", pa.int64()),
+    ("name", pa.string()),
+    ("text", pa.large_string()),
+    ("format", pa.string()),
+])
+CHUNKS_SCHEMA = pa.schema([
+    ("file_key", pa.int64()),
+    ("content", pa.large_string()),
+    ("start_index", pa.int32()),
+])
+NOTES_SCHEMA = pa.schema([
+    ("note_key", pa.int64()),
+    ("name", pa.string()),
+    ("type", pa.string()),
+    ("content", pa.large_string()),
+    ("created_at", pa.string()),
+    ("contained_file_keys", pa.list_(pa.int64())),
+])
+
+def _audio_path(note_id):
+    return os.path.join(TTS["AUDIO_PATH"], f"{note_id}.wav") if TTS["AUDIO_PATH"] else None
+
+def export_collection(collection_id, bundle_dir):
+    """
+    Write the files, chunks (with their embeddings) and ready notes of a collection to bundle_dir.
+    The original ids are kept as keys, only to link chunks and notes to their files.
+    """
+    bundle = Path(bundle_dir)
+    bundle.mkdir(parents=True, exist_ok=False)
+    bilduma = db.get_bilduma(collection_id)
+    if bilduma is None:
+        raise ValueError(f"Collection {collection_id} does not exist")
+
+    n_files = 0
+    with pq.ParquetWriter(bundle / "files.parquet", FILES_SCHEMA, compression="zstd") as writer:
+        for rows in db.fetch_batches(
+            "SELECT id, name, text, format FROM Fitxategia WHERE bilduma_key = %s ORDER BY id",
+            (collection_id,), row_factory="tuple", batch_size=50, statement="export_files",
+        ):
+            file_keys, names, texts, formats = zip(*rows)
+            writer.write_table(pa.table([list(file_keys), list(names), list(texts), list(formats)], schema=FILES_SCHEMA))
+            n_files += len(rows)
+
+    # The embeddings are written straight into a memory-mapped .npy of the final size
+    n_chunks = db.count_collection_documents(collection_id)
+    embeddings = None
+    offset = 0
+    with pq.ParquetWriter(bundle / "chunks.parquet", CHUNKS_SCHEMA, compression="zstd") as writer:
+        for batch in db.iter_collection_documents(collection_id):
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(
+                    bundle / "embeddings.npy", mode="w+", dtype=np.float32, shape=(n_chunks, batch["embeddings"].shape[1]),
+                )
+            n = len(batch["ids"])
+            embeddings[offset:offset + n] = batch["embeddings"]
+            offset += n
+            writer.write_table(pa.table([batch["file_ids"], batch["texts"], batch["start_indexes"]], schema=CHUNKS_SCHEMA))
+    if embeddings is None:
+        embeddings = np.lib.format.open_memmap(bundle / "embeddings.npy", mode="w+", dtype=np.float32, shape=(0, 0))
+    embedding_dim = embeddings.shape[1]
+    embeddings.flush()
+    del embeddings
+    if offset != n_chunks:
+        raise RuntimeError(f"The chunks of collection {collection_id} changed during the export")
+
+    # Only the ready notes (status 1)
+    notes = [ note for note in db.get_notes(collection_id) if note["status"] == 1 ]
+    pq.write_table(pa.table([
+        [ note["id"] for note in notes ],
+        [ note["name"] for note in notes ],
+        [ note["type"] for note in notes ],
+        [ note["content"] for note in notes ],
+        [ note["created_at"] for note in notes ],
+        [ list(note["contained_file_ids"] or []) for note in notes ],
+    ], schema=NOTES_SCHEMA), bundle / "notes.parquet", compression="zstd")
+    for note in notes:
+        audio = _audio_path(note["id"])
+        if note["type"] == "podcast" and audio and os.path.exists(audio):
+            (bundle / "audio").mkdir(exist_ok=True)
+            shutil.copyfile(audio, bundle / "audio" / f"{note['id']}.wav")
+
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "exported_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "collection": {
+            "id": bilduma["id"],
+            "name": bilduma["name"],
+            "title": bilduma["title"],
+            "summary": bilduma["summary"],
+        },
+        "vectorizer_id": RAG["VECTORIZER_ID"],
+        "embedding_dim": embedding_dim,
+        "files": n_files,
+        "chunks": n_chunks,
+        "notes": len(notes),
+    }
+    with open(bundle / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    logger.info(f"Exported collection {collection_id} to {bundle}: {n_files} files, {n_chunks} chunks, {len(notes)} notes")
+    return manifest
+
+def read_manifest(bundle_dir):
+    with open(Path(bundle_dir) / "manifest.json", "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest["version"] > BUNDLE_VERSION:
+        raise ValueError(f"Unsupported bundle version {manifest['version']}")
+    return manifest
+
+def load_embeddings(bundle_dir):
+    """
+    The embedding matrix of a bundle, memory-mapped (read-only).
+    """
+    return np.load(Path(bundle_dir) / "embeddings.npy", mmap_mode="r")
+
+def iter_index_batches(collection_id, doc_ids, texts, embeddings, batch_size=db.FETCH_BATCH_SIZE):
+    """
+    Column-wise batches as expected by rag._load_vector_store, with the embeddings sliced from the mapped matrix.
+    """
+    for start in range(0, len(doc_ids), batch_size):
+        end = start + batch_size
+        yield {
+            "collection_id": collection_id,
+            "ids": doc_ids[start:end],
+            "texts": texts[start:end],
+            "embeddings": np.ascontiguousarray(embeddings[start:end], dtype=np.float32),
+        }
+
+def build_index(embeddings, batch_size=db.FETCH_BATCH_SIZE):
+    """
+    The FAISS index of a collection (see ann_index.build), built from the memory-mapped embedding matrix in batches.
+    Returns (index, params).
+    """
+    flat = faiss.IndexFlatIP(embeddings.shape[1])
+    for start in range(0, len(embeddings), batch_size):
+        flat.add(ann_index.normalize(embeddings[start:start + batch_size]))
+    return ann_index.build(flat, rag.FAISS_FETCH_K)
+
+def import_collection(bundle_dir, collection_id=None, name=None, allow_model_mismatch=False, load_index=False):
+    """
+    Create a new collection from a bundle: bulk-load its files, chunks (with the bundled embeddings) and notes.
+    Its index is built from the memory-mapped embeddings and persisted, for the server to memory-map on the first query.
+    With load_index, the collection's RAG graph is loaded too (when running inside the server).
+    Returns the id of the new collection.
+    """
+    bundle = Path(bundle_dir)
+    manifest = read_manifest(bundle)
+    if manifest["vectorizer_id"] != RAG["VECTORIZER_ID"] and not allow_model_mismatch:
+        raise ValueError(
+            f"The bundle embeddings were computed with {manifest['vectorizer_id']}, but this deployment uses {RAG['VECTORIZER_ID']}"
+        )
+    # Chunk i gets embedding row i: a bundle whose parts disagree would be imported partially
+    embeddings = load_embeddings(bundle)
+    n_chunks = pq.ParquetFile(bundle / "chunks.parquet").metadata.num_rows
+    if not n_chunks == embeddings.shape[0] == manifest["chunks"]:
+        raise ValueError(
+            f"Inconsistent bundle: {n_chunks} chunks, {embeddings.shape[0]} embeddings, {manifest['chunks']} in the manifest"
+        )
+    if embeddings.ndim != 2 or embeddings.shape[1] != manifest["embedding_dim"]:
+        raise ValueError(f"Inconsistent bundle: embeddings of shape {embeddings.shape}, dimension {manifest['embedding_dim']} in the manifest")
+    collection_id = int(collection_id or time.time() * 1000)
+    info = manifest["collection"]
+    db.create_bilduma({"id": collection_id, "title": name or info["name"], "date": datetime.date.today().isoformat()})
+    copied_audios = []
+    try:
+        db.set_descriptors_to_bilduma(collection_id, name or info["name"], info["title"], info["summary"])
+
+        file_ids = {}
+        for batch in pq.ParquetFile(bundle / "files.parquet").iter_batches(batch_size=50):
+            for row in batch.to_pylist():
+                parsed = {"success": True, "filename": row["name"], "text": row["text"], "file_type": row["format"]}
+                file_ids[row["file_key"]] = db.store_fitxategia(collection_id, parsed)
+
+        doc_ids, texts = [], []
+        offset = 0
+        for batch in pq.ParquetFile(bundle / "chunks.parquet").iter_batches(batch_size=db.COPY_BATCH_SIZE):
+            columns = batch.to_pydict()
+            n = len(columns["content"])
+            docs = [
+                {"content": content, "start_index": start_index, "file_id": file_ids[file_key], "embedding": embedding}
+                for content, start_index, file_key, embedding in zip(
+                    columns["content"], columns["start_index"], columns["file_key"], embeddings[offset:offset + n],
+                )
+            ]
+            doc_ids.extend(db.store_documents(docs))
+            texts.extend(columns["content"])
+            offset += n
+
+        for row in pq.read_table(bundle / "notes.parquet").to_pylist():
+            note_id = db.import_note(collection_id, {
+                "status": 1,
+                "name": row["name"],
+                "type": row["type"],
+                "content": row["content"],
+                "created_at": row["created_at"],
+                "contained_file_ids": [ file_ids[k] for k in row["contained_file_keys"] if k in file_ids ],
+            })
+            audio = bundle / "audio" / f"{row['note_key']}.wav"
+            if audio.exists() and TTS["AUDIO_PATH"]:
+                os.makedirs(TTS["AUDIO_PATH"], exist_ok=True)
+                copied_audios.append(_audio_path(note_id))
+                shutil.copyfile(audio, copied_audios[-1])
+    except Exception:
+        db.delete_bilduma({"id": collection_id})
+        for path in copied_audios:
+            Path(path).unlink(missing_ok=True)
+        raise
+
+    if doc_ids:
+        index, params = build_index(embeddings)
+        index_store.save(collection_id, index, params, doc_ids, texts)
+        if load_index:
+            rag.init_collection_graph(
+                collection_id, iter_index_batches(collection_id, doc_ids, texts, embeddings),
+                index_store.chunk_set_version(doc_ids),
+            )
+    logger.info(f"Imported {bundle} as collection {collection_id}: {len(file_ids)} files, {len(doc_ids)} chunks")
+    return collection_id
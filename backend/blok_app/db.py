@@ -1,11 +1,25 @@
 import psycopg2
+import psycopg2.extras
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
 from collections import namedtuple
-import datetime
+from contextlib import contextmanager
+import numpy as np
+import hashlib
+import io
+import logging
+import struct
+import threading
+import time
+import uuid
 import sys
 sys.path.insert(0, "../..")
 from pdb import set_trace as d
 from backend.blok_app.document_parser_backend_ocr import extract_from_documents
-from backend.config import DATABASE
+from backend.config import DATABASE, RAG
+import backend.blok_app.db_metrics as db_metrics
+
+logger = logging.getLogger(__name__)
 
 ###################################################################################
     #########################      LAGUNTZAILEAK       ############################
@@ -37,7 +51,7 @@ file_type = {
 
 def get_db():
     """
-    Opens a new psycopg2 connection and returns it.
+    Opens a new psycopg2 connection (outside the pool) and returns it.
     Caller must close it: conn.close()
     """
     return psycopg2.connect(
@@ -48,64 +62,397 @@ def get_db():
         dbname=DATABASE["name"],
     )
 
-def query_db(query, args = ()):
-    conn = get_db()
-    cur = conn.cursor()
-    print("Query: ",query)
-    presql=datetime.datetime.now()
-    cur.execute(query, args)
-    postsql=datetime.datetime.now()
-    print("PostgreSQL: fetched results in: ",postsql-presql)          
-    result = namedtuplefetchall(cur)
-    postsql2=datetime.datetime.now()
-    print("PostgreSQL: prepared results in tuples: ",postsql2-postsql)
-    cur.close()
-    conn.close()
-    return result
+###################################################################################
+    #########################      KONEXIO POOLA       ############################
+###################################################################################
 
-def commit_query_db(query, params = None):
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool fails when it is exhausted: callers wait for a free slot instead
+_pool_slots = threading.BoundedSemaphore(DATABASE["POOL_MAX"])
+_conn_created = {}  # id(conn) -> creation time
+_conn_last_used = {}  # id(conn) -> last time it was returned to the pool
+_conn_prepared = {}  # id(conn) -> names of the statements prepared in its session
+_local = threading.local()  # pool_wait: seconds the current thread waited for its last connection
+pool_stats = {
+    "acquired": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+    "opened": 0,
+    "discarded": 0,
+}
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(
+                DATABASE["POOL_MIN"],
+                DATABASE["POOL_MAX"],
+                host=DATABASE["host"],
+                port=DATABASE["port"],
+                user=DATABASE["user"],
+                password=DATABASE["password"],
+                dbname=DATABASE["name"],
+            )
+    return _pool
+
+def _forget(conn):
+    """
+    Drop the state kept by id(conn): once the connection is closed, its id may be reused by a new one.
+    """
+    with _pool_lock:
+        _conn_created.pop(id(conn), None)
+        _conn_last_used.pop(id(conn), None)
+        _conn_prepared.pop(id(conn), None)
+
+def _discard(pool, conn):
+    _forget(conn)
+    with _pool_lock:
+        pool_stats["discarded"] += 1
+    pool.putconn(conn, close=True)
+
+def _is_healthy(conn):
+    """
+    Check a pooled connection before handing it out: closed, too old, or idle for a while and not answering.
+    """
+    if conn.closed:
+        return False
+    now = time.time()
+    with _pool_lock:
+        created = _conn_created.setdefault(id(conn), now)
+        last_used = _conn_last_used.get(id(conn), None)
+    if created == now:
+        with _pool_lock:
+            pool_stats["opened"] += 1
+    if now - created > DATABASE["POOL_MAX_AGE"]:
+        return False
+    if last_used is not None and now - last_used > DATABASE["POOL_CHECK_IDLE"]:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+    return True
+
+@contextmanager
+def connection():
+    """
+    Borrow a healthy connection from the process-wide pool, waiting for one if all are in use.
+    The connection goes back to the pool (rolled back if a transaction was left open) at the end of the block.
+    """
+    start = time.time()
+    if not _pool_slots.acquire(timeout=DATABASE["POOL_TIMEOUT"]):
+        raise psycopg2.pool.PoolError(f"No database connection available after {DATABASE['POOL_TIMEOUT']}s")
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        print("Query: ",query[:100])
-        presql=datetime.datetime.now()
-        if params and type(params[0]) in [list, tuple]:
-            cur.executemany(query, params)
-            result = None
-        else:
-            cur.execute(query, params)
-            try:
-                result = cur.fetchone()[0]
-            except Exception:
-                result = None
+        pool = _get_pool()
+        conn = pool.getconn()
+        while not _is_healthy(conn):
+            _discard(pool, conn)
+            conn = pool.getconn()
+        wait = time.time() - start
+        _local.pool_wait = wait
+        with _pool_lock:
+            pool_stats["acquired"] += 1
+            pool_stats["wait_seconds_total"] += wait
+            pool_stats["wait_seconds_max"] = max(pool_stats["wait_seconds_max"], wait)
+        try:
+            yield conn
+        finally:
+            if conn.closed:
+                _discard(pool, conn)
+            else:
+                try:
+                    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    with _pool_lock:
+                        _conn_last_used[id(conn)] = time.time()
+                    pool.putconn(conn)
+                    # The pool closes returned connections beyond minconn idle ones (only if DB_POOL_MIN < DB_POOL_MAX)
+                    if conn.closed:
+                        _forget(conn)
+                except psycopg2.Error:
+                    _discard(pool, conn)
+    finally:
+        _pool_slots.release()
+
+@contextmanager
+def transaction():
+    """
+    Run the block in a transaction of a pooled connection: yields a cursor, commits at the end, rolls back on errors.
+    """
+    with connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                yield cur
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def pool_metrics():
+    """
+    Pool wait times and the age of the open connections, in seconds.
+    """
+    now = time.time()
+    with _pool_lock:
+        ages = [ now - created for created in _conn_created.values() ]
+        acquired = pool_stats["acquired"]
+        return {
+            **pool_stats,
+            "wait_seconds_avg": pool_stats["wait_seconds_total"] / acquired if acquired else 0.0,
+            "connections": len(ages),
+            "connection_age_max": max(ages, default=0.0),
+            "connection_age_avg": sum(ages) / len(ages) if ages else 0.0,
+            "min_size": DATABASE["POOL_MIN"],
+            "max_size": DATABASE["POOL_MAX"],
+        }
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _conn_created.clear()
+            _conn_last_used.clear()
+            _conn_prepared.clear()
+
+###################################################################################
+    #########################      SENTENTZIAK       ############################
+###################################################################################
+
+"""
+    Named statements of the data-access functions, prepared once per pooled connection (PREPARE/EXECUTE)
+    so that PostgreSQL parses and plans them once per session. Parameters are $1, $2...
+"""
+STATEMENTS = {
+    # Bildumak
+    "get_bildumak": (
+        "SELECT B.id, B.name, B.title, B.summary, B.create_date::TEXT AS c_date, B.update_date::TEXT AS u_date, "
+        "(SELECT COUNT(*) FROM Fitxategia AS F WHERE F.bilduma_key = B.id) AS fitxategia_count FROM Bilduma AS B"
+    ),
+    "get_bilduma": "SELECT id, name, title, summary, create_date::TEXT AS c_date, update_date::TEXT AS u_date FROM Bilduma WHERE id = $1",
+    "create_bilduma": "INSERT INTO Bilduma (id, name, create_date, update_date) VALUES ($1, $2, $3, $3)",
+    "set_descriptors_to_bilduma": "UPDATE Bilduma SET name = $1, title = $2, summary = $3 WHERE id = $4",
+    "delete_bilduma": "DELETE FROM Bilduma WHERE id = $1",
+    "rename_bilduma": "UPDATE Bilduma SET name = $1, update_date = CURRENT_DATE WHERE id = $2",
+    "set_chat_id": "UPDATE Bilduma SET chat_id = $1 WHERE id = $2",
+    "get_chat_id": "SELECT chat_id FROM Bilduma WHERE id = $1",
+    # Fitxategiak
+    "get_fitxategia": "SELECT id, name, text, charNum, format FROM Fitxategia WHERE id = $1",
+    "store_fitxategia": (
+        "INSERT INTO Fitxategia (name, text, charNum, format, content_hash, bilduma_key) "
+        "VALUES ($1, $2, $3, $4, $5, $6) RETURNING id"
+    ),
+    "get_indexed_content_hashes": (
+        "SELECT DISTINCT f.content_hash AS content_hash FROM Fitxategia AS f "
+        "WHERE f.bilduma_key = $1 AND f.content_hash IS NOT NULL "
+        "AND EXISTS (SELECT 1 FROM Document AS doc WHERE doc.file_id = f.id)"
+    ),
+    # Documents
+    "delete_collection_documents": "DELETE FROM Document AS doc USING Fitxategia AS f WHERE doc.file_id = f.id AND f.bilduma_key = $1",
+    "get_document": (
+        "SELECT doc.id as id, doc.content as text, doc.start_index as offset, file.id as file_id, file.name as file_title, file.text as file_text "
+        "FROM Document as doc INNER JOIN Fitxategia as file ON doc.file_id = file.id WHERE doc.id = $1"
+    ),
+    # Notak
+    "get_notes": "SELECT id, status, name, content, type, contained_file_ids, created_at::TEXT AS created_at FROM Note WHERE bilduma_key = $1",
+    "get_note": "SELECT id, status, name, content, type, contained_file_ids, created_at::TEXT AS created_at FROM Note WHERE id = $1",
+    "ezabatu_nota": "DELETE FROM Note WHERE id = $1",
+    "create_empty_note": (
+        "INSERT INTO Note (status, name, type, content, contained_file_ids, bilduma_key) "
+        "VALUES (0, '', $1, '', $2, $3) RETURNING id"
+    ),
+    "update_note": "UPDATE Note SET status = 1, name = $1, content = $2 WHERE id = $3",
+    "fail_note": "UPDATE Note SET status = 2 WHERE id = $1",
+    "import_note": (
+        "INSERT INTO Note (status, name, type, content, created_at, contained_file_ids, bilduma_key) "
+        "VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id"
+    ),
+    "count_collection_documents": (
+        "SELECT COUNT(*) FROM Document AS doc INNER JOIN Fitxategia AS f ON doc.file_id = f.id WHERE f.bilduma_key = $1"
+    ),
+    # Chunk ids only grow, so count, max and sum of the ids change whenever chunks are added or deleted
+    "get_chunk_set_version": (
+        "SELECT COUNT(*) || '-' || COALESCE(MAX(doc.id), 0) || '-' || COALESCE(SUM(doc.id), 0) "
+        "FROM Document AS doc INNER JOIN Fitxategia AS f ON doc.file_id = f.id WHERE f.bilduma_key = $1"
+    ),
+}
+
+def _prepare(conn, cur, name):
+    with _pool_lock:
+        prepared = _conn_prepared.setdefault(id(conn), set())
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+        prepared.add(name)
+
+def _forget_prepared(conn):
+    # After a failed transaction, drop the session's statements so they are prepared again from a known state
+    with _pool_lock:
+        _conn_prepared.pop(id(conn), None)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DEALLOCATE ALL")
         conn.commit()
-        postsql=datetime.datetime.now()
-        print("PostgreSQL: commited succesfully the change: ",postsql-presql) 
-        cur.close()
-        conn.close()
-        return result
-    except Exception as exc:
+    except psycopg2.Error:
         conn.rollback()
-        print("Query failed:", exc)
-        raise exc
 
-        
+def _explain(cur, sql, args):
+    try:
+        cur.execute(f"EXPLAIN {sql}", args)
+        return "\n".join( row[0] for row in cur.fetchall() )
+    except psycopg2.Error as exc:
+        cur.connection.rollback()
+        return f"EXPLAIN failed: {exc}"
+
+def _record(name, start, sql, args, cur=None, explain_sql=None, rows=0, nbytes=0, error=False):
+    """
+    Record a call in db_metrics and log it if it was slow (EXPLAINing explain_sql on cur, if given).
+    """
+    seconds = time.perf_counter() - start
+    db_metrics.record(name, seconds, error=error, rows=rows, nbytes=nbytes, pool_wait=getattr(_local, "pool_wait", 0.0))
+    if db_metrics.is_slow(seconds):
+        plan = None
+        if cur is not None and explain_sql is not None and db_metrics.should_explain(name, seconds):
+            plan = _explain(cur, explain_sql, args)
+        db_metrics.log_slow(name, sql, args, seconds, plan)
+
+def run_statement(name, args=(), fetch="all"):
+    """
+    Execute a named statement of STATEMENTS in its own transaction.
+    fetch: "all" (list of dicts), "one" (dict or None), "value" (first column of the first row, e.g. RETURNING id) or None.
+    """
+    start = time.perf_counter()
+    rows = []
+    try:
+        with connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    _prepare(conn, cur, name)
+                    placeholders = f" ({', '.join(['%s'] * len(args))})" if args else ""
+                    cur.execute(f"EXECUTE {name}{placeholders}", args)
+                    if fetch == "all":
+                        rows = cur.fetchall()
+                        result = _dict_rows(cur, rows)
+                    elif fetch == "one":
+                        rows = cur.fetchmany(1)
+                        result = _dict_rows(cur, rows)[0] if rows else None
+                    elif fetch == "value":
+                        rows = cur.fetchmany(1)
+                        result = rows[0][0] if rows else None
+                    else:
+                        result = None
+                    nrows = len(rows) if fetch else max(cur.rowcount, 0)
+                    conn.commit()
+                    # EXPLAIN (without ANALYZE) in the same session, where the statement is prepared
+                    _record(name, start, STATEMENTS[name], args, cur, f"EXECUTE {name}{placeholders}", nrows, db_metrics.rows_size(rows))
+            except Exception:
+                conn.rollback()
+                _forget_prepared(conn)
+                raise
+    except Exception:
+        db_metrics.record(name, time.perf_counter() - start, error=True)
+        logger.exception(f"Statement {name} failed")
+        raise
+    return result
 
+###################################################################################
+
+def query_db(query, args = ()):
+    """
+    Ad-hoc query (not in STATEMENTS); recorded in db_metrics as "query_db".
+    """
+    start = time.perf_counter()
+    with transaction() as cur:
+        cur.execute(query, args)
+        result = namedtuplefetchall(cur)
+        _record("query_db", start, query, args, cur, query, len(result), db_metrics.rows_size(result))
+    return result
+
+def commit_query_db(query, params = None):
+    """
+    Ad-hoc modifying statement (not in STATEMENTS); recorded in db_metrics as "commit_query_db".
+    """
+    start = time.perf_counter()
+    try:
+        with transaction() as cur:
+            if params and type(params[0]) in [list, tuple]:
+                cur.executemany(query, params)
+                result = None
+            else:
+                cur.execute(query, params)
+                try:
+                    result = cur.fetchone()[0]
+                except Exception:
+                    result = None
+            _record("commit_query_db", start, query, params, rows=max(cur.rowcount, 0))
+    except Exception:
+        db_metrics.record("commit_query_db", time.perf_counter() - start, error=True)
+        logger.exception("Query commit_query_db failed")
+        raise
+    return result
 
 def namedtuplefetchall(cursor):
     "Return all rows from a cursor as a namedtuple"
-    desc = cursor.description
-    fields=[col[0] for col in desc]        
+    fields = [ col[0] for col in cursor.description ]
     result_obj = namedtuple('rslt_obj', fields)
-    result=[]
-    while True:        
-        row = cursor.fetchone()
-        if not row:
-            break
-                            
-        result.append(result_obj(*row))     
-    return result
+    return [ result_obj._make(row) for row in cursor.fetchall() ]
+
+FETCH_BATCH_SIZE = 2000
+
+def _dict_rows(cursor, rows):
+    columns = [ col[0] for col in cursor.description ]
+    return [ dict(zip(columns, row)) for row in rows ]
+
+ROW_FACTORIES = {
+    "tuple": lambda cursor, rows: rows,
+    "dict": _dict_rows,
+}
 
+def fetch_batches(query, args=(), row_factory="dict", batch_size=FETCH_BATCH_SIZE, server_side=True, statement="fetch_batches"):
+    """
+    Run a query and yield its rows in lists of up to batch_size, as dicts or tuples (row_factory).
+    With server_side, the rows are read from a named (server-side) cursor with fetchmany, so only one
+    batch is held in memory at a time. The pooled connection is kept until the generator is exhausted or closed.
+    Only the time spent in the database (not in the consumer) is recorded in db_metrics, under the statement name.
+    """
+    make_rows = ROW_FACTORIES[row_factory]
+    db_seconds, nrows, nbytes = 0.0, 0, 0
+    error = False
+    try:
+        with connection() as conn:
+            name = f"fetch_{uuid.uuid4().hex}" if server_side else None
+            with conn.cursor(name=name) as cur:
+                if server_side:
+                    cur.itersize = batch_size
+                start = time.perf_counter()
+                cur.execute(query, args)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    db_seconds += time.perf_counter() - start
+                    if not rows:
+                        break
+                    nrows += len(rows)
+                    nbytes += db_metrics.rows_size(rows)
+                    yield make_rows(cur, rows)
+                    start = time.perf_counter()
+    except Exception:
+        error = True
+        raise
+    finally:
+        # Also recorded when the consumer stops early (generator closed)
+        db_metrics.record(statement, db_seconds, error=error, rows=nrows, nbytes=nbytes, pool_wait=getattr(_local, "pool_wait", 0.0))
+        if not error and db_metrics.is_slow(db_seconds):
+            db_metrics.log_slow(statement, query, args, db_seconds)
+
+def iter_query(query, args=(), row_factory="dict", batch_size=FETCH_BATCH_SIZE, server_side=True, statement="iter_query"):
+    """
+    Generator over the rows of a query, fetched in batches (see fetch_batches).
+    """
+    for rows in fetch_batches(query, args, row_factory, batch_size, server_side, statement):
+        yield from rows
 
 def sql_where_clause(params):
     whereclause = " where"
@@ -133,65 +480,46 @@ def get_from_table(where_conditions, select_string="", source_info=False):
     return from_clause
 
 def query_db_as_dict(sql, args=(), one=False):
-	sql_result=query_db(sql,args)    
-	result = []
-	for i in sql_result:
-		result.append(i._asdict())
-		
-	print("QUERY_DB_AS_DICT- RESULT: ", sql_result)
-	
-	return result
+    # Small result sets: a client-side cursor, rows turned into dicts directly
+    return list(iter_query(sql, args, server_side=False, statement="query_db_as_dict"))
 
 ###################################################################################
    ###########################      BILDUMAK       #############################
 ###################################################################################
 
 def get_bildumak():
-    from_tables=get_from_table('',select_string='fitxa')
-    query = "SELECT  B.id, B.name, B.title, B.summary, B.create_date::TEXT AS c_date, B.update_date::TEXT AS u_date, COUNT(F.id) AS fitxategia_count " + from_tables + " GROUP BY B.id, B.name, B.create_date, B.update_date"
-    return query_db_as_dict(query)
+    return run_statement("get_bildumak")
 
 def get_bilduma(id):
-    bilduma_sql = f"SELECT id, name, title, summary, create_date::TEXT AS c_date, update_date::TEXT AS u_date FROM Bilduma WHERE id = {id};"
-    return query_db_as_dict(bilduma_sql)[0]
+    return run_statement("get_bilduma", (id,), fetch="one")
 
 def create_bilduma(args):
-    id = args["id"]
-    title = args["title"]
-    date = args["date"]
-    q = f"INSERT INTO Bilduma (id, name, create_date, update_date) VALUES ({id}, '{title}', '{date}', '{date}');"
-    commit_query_db(q)
+    run_statement("create_bilduma", (args["id"], args["title"], args["date"]), fetch=None)
 
 def set_descriptors_to_bilduma(id, name, title, summary):
-    q = "UPDATE Bilduma SET name = %s, title = %s, summary = %s where id = %s"
-    commit_query_db(q, (name, title, summary, id))
+    run_statement("set_descriptors_to_bilduma", (name, title, summary, id), fetch=None)
 
 def delete_bilduma(args):
-    id = args["id"]
-    q = f"DELETE FROM Bilduma WHERE id = {id};"
-    commit_query_db(q)
+    run_statement("delete_bilduma", (args["id"],), fetch=None)
 
 def rename_bilduma(args):
-    id = args["id"]
-    title = args['title']
-    q = f"UPDATE Bilduma SET name = '{title}', update_date = CURRENT_DATE WHERE id = {id};"
-    commit_query_db(q)
+    run_statement("rename_bilduma", (args["title"], args["id"]), fetch=None)
 
 def set_chat_id(nt_id, chat_id):
-    q = "UPDATE Bilduma SET chat_id = %s WHERE id = %s;"
-    commit_query_db(q, (chat_id, nt_id))
+    run_statement("set_chat_id", (chat_id, nt_id), fetch=None)
 
 def get_chat_id(nt_id):
-    q = f"SELECT chat_id FROM Bilduma WHERE id = {nt_id};"
-    return query_db_as_dict(q)
+    return run_statement("get_chat_id", (nt_id,))
 
 ###################################################################################
   ########################       FITXATEGIAK        #############################
 ###################################################################################
 
-def get_fitxategiak(collection_id, content=False, file_ids=[]):
-    args = []
-    filter_collection = f"bilduma_key = {collection_id}"
+def iter_fitxategiak(collection_id, content=False, file_ids=[]):
+    """
+    Stream the files of a collection (optionally with their text), without loading them all in memory.
+    """
+    args = [collection_id]
     filter_files = ""
     if file_ids:
         filter_files = "AND id = ANY(%s)"
@@ -199,17 +527,36 @@ def get_fitxategiak(collection_id, content=False, file_ids=[]):
     select_content = ""
     if content:
         select_content = ", text"
-    notak_sql = f"SELECT id, name, format {select_content} FROM Fitxategia WHERE {filter_collection} {filter_files};"
-    return query_db_as_dict(notak_sql, args=tuple(args))
+    notak_sql = f"SELECT id, name, format {select_content} FROM Fitxategia WHERE bilduma_key = %s {filter_files}"
+    # Texts are large: fetch them a few at a time
+    return iter_query(notak_sql, tuple(args), batch_size=50 if content else FETCH_BATCH_SIZE, statement="iter_fitxategiak")
+
+def get_fitxategiak(collection_id, content=False, file_ids=[]):
+    return list(iter_fitxategiak(collection_id, content, file_ids))
 
 def get_fitxategia(id):
-    notak_sql = f"SELECT id, name, text, charNum, format FROM Fitxategia WHERE id = {id};"
-    return query_db_as_dict(notak_sql)[0]
+    return run_statement("get_fitxategia", (id,), fetch="one")
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def store_fitxategia(id, parsed):
+    """
+    Insert a parsed file (as returned by extract_from_documents) into the given notebook.
+    Sets the 'id' and 'content_hash' of the new Fitxategia row in the parsed dict.
+    """
+    if not parsed['success']:
+        raise Exception(f"The file {parsed['filename']} could not be properly read.")
+    parsed['content_hash'] = content_hash(parsed['text'])
+    params = (parsed['filename'], parsed['text'], len(parsed['text']), file_type[parsed['file_type']] if parsed['file_type'] in file_type else parsed['file_type'], parsed['content_hash'], id)
+    parsed['id'] = run_statement("store_fitxategia", params, fetch="value")
+    return parsed['id']
 
 def upload_fitxategiak(id: str, files):
     """
     Save every uploaded file for the given notebook.
     files: list of Sanic File objects (f.name, f.body, f.type)
+    Each returned parsed file gets the 'id' and 'content_hash' of its new Fitxategia row.
     """
 
     # --- Parse text using the unchanged parser ---
@@ -219,76 +566,212 @@ def upload_fitxategiak(id: str, files):
         raise Exception(f'Error: Extracting content from files; {str(e)}')
     try:
         for parsed in parsed_files:
-            
-            if not parsed['success']:
-                # handle / log error
-                raise Exception('The file could not be properly read.')
-            
-            # --- Insert into DB ---
-            q = "INSERT INTO Fitxategia (name, text, charNum, format, bilduma_key) VALUES (%s, %s, %s, %s, %s)"
-            params = (parsed['filename'], parsed['text'], len(parsed['text']), file_type[parsed['file_type']] if parsed['file_type'] in file_type else parsed['file_type'], id)
-            commit_query_db(q, params)
-    
+            store_fitxategia(id, parsed)
     except Exception as e:
         raise Exception(f'Error: Saving the files in database; {str(e)}')
 
     return parsed_files
 
+def get_indexed_content_hashes(collection_id):
+    """
+    Content hashes of the files of the collection that already have chunks in the Document table.
+    """
+    return { row['content_hash'] for row in run_statement("get_indexed_content_hashes", (collection_id,)) }
+
+# Embedding storage formats (RAG["EMBEDDING_STORAGE"]): the Document column holding the vectors,
+# the SQL expression reading them and, for the packed formats, the dtype of the stored bytes
+EMBEDDING_COLUMNS = {
+    "float8": "embedding",
+    "float32": "embedding_blob",
+    "float16": "embedding_blob",
+    "pgvector": "embedding_vec",
+}
+EMBEDDING_SELECT = {
+    "float8": "doc.embedding",
+    "float32": "doc.embedding_blob",
+    "float16": "doc.embedding_blob",
+    # pgvector's binary form: int16 dim, int16 unused, then big-endian float4 values
+    "pgvector": "vector_send(doc.embedding_vec)",
+}
+EMBEDDING_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+    "pgvector": np.dtype(">f4"),
+}
+
+def pack_embedding(embedding, storage=RAG["EMBEDDING_STORAGE"]):
+    """
+    Bytes of an embedding in a packed storage format (float32, float16 or pgvector's binary form).
+    """
+    values = np.asarray(embedding, dtype=EMBEDDING_DTYPES[storage])
+    if storage == "pgvector":
+        return struct.pack(">hh", len(values), 0) + values.tobytes()
+    return values.tobytes()
+
+def embedding_matrix(values, storage=RAG["EMBEDDING_STORAGE"]):
+    """
+    Build a contiguous float32 (n, dim) matrix from the embeddings read from the DB (float8 lists or packed bytes).
+    Packed embeddings are concatenated and read with np.frombuffer, without a Python object per element.
+    """
+    if storage == "float8":
+        return np.asarray(values, dtype=np.float32)
+    if not values:
+        return np.empty((0, 0), dtype=np.float32)
+    matrix = np.frombuffer(b"".join(values), dtype=EMBEDDING_DTYPES[storage]).reshape(len(values), -1)
+    if storage == "pgvector":
+        # Drop the 4-byte header of each row (read as one extra float4 column)
+        matrix = matrix[:, 1:]
+    return np.ascontiguousarray(matrix, dtype=np.float32)
+
+# Binary COPY format: signature, flags and header extension length
+_COPY_HEADER = b"PGCOPY\n\377\r\n\0" + struct.pack(">ii", 0, 0)
+_COPY_TRAILER = struct.pack(">h", -1)
+_FLOAT8_OID = 701
+# Each float8 array element is sent as its length (always 8) followed by the value
+_FLOAT8_ELEMENT = np.dtype([("len", ">i4"), ("value", ">f8")])
+COPY_BATCH_SIZE = 5000
+
+def _copy_bytes(data):
+    return struct.pack(">i", len(data)) + data
+
+def _copy_float8_array(values):
+    elements = np.empty(len(values), dtype=_FLOAT8_ELEMENT)
+    elements["len"] = 8
+    elements["value"] = values
+    return _copy_bytes(struct.pack(">iiiii", 1, 0, _FLOAT8_OID, len(values), 1) + elements.tobytes())
+
+def _copy_embedding(embedding, storage):
+    if storage == "float8":
+        return _copy_float8_array(embedding)
+    # bytea and pgvector's binary input take the packed bytes as they are
+    return _copy_bytes(pack_embedding(embedding, storage))
+
+def _copy_documents_stream(ids, docs, storage):
+    """
+    Binary COPY payload for the (id, content, <embedding column>, start_index, file_id) columns of Document.
+    """
+    buf = io.BytesIO()
+    buf.write(_COPY_HEADER)
+    for doc_id, doc in zip(ids, docs):
+        buf.write(struct.pack(">hiq", 5, 8, doc_id))
+        buf.write(_copy_bytes(doc['content'].encode("utf-8")))
+        buf.write(_copy_embedding(doc['embedding'], storage))
+        buf.write(struct.pack(">iiiq", 4, doc['start_index'], 8, doc['file_id']))
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
 def store_documents(docs):
-    q = "INSERT INTO Document (content, embedding, start_index, file_id) VALUES (%s, %s, %s, %s)"
-    params = [ (d['content'], d['embedding'], d['start_index'], d['file_id']) for d in docs ]
-    commit_query_db(q, params)
+    """
+    Insert the chunks and return their generated ids, in the same order as docs.
+    The ids are reserved from the identity sequence first, then the rows are streamed with a binary COPY in batches.
+    Embeddings are written in the RAG["EMBEDDING_STORAGE"] format.
+    """
+    if not docs:
+        return []
+    start = time.perf_counter()
+    storage = RAG["EMBEDDING_STORAGE"]
+    copy_sql = f"COPY Document (id, content, {EMBEDDING_COLUMNS[storage]}, start_index, file_id) FROM STDIN WITH (FORMAT binary)"
+    try:
+        with transaction() as cur:
+            cur.execute(
+                "SELECT nextval(pg_get_serial_sequence('document', 'id')) FROM generate_series(1, %s)",
+                (len(docs),),
+            )
+            ids = [ row[0] for row in cur.fetchall() ]
+            for batch in range(0, len(docs), COPY_BATCH_SIZE):
+                cur.copy_expert(copy_sql, _copy_documents_stream(ids[batch:batch + COPY_BATCH_SIZE], docs[batch:batch + COPY_BATCH_SIZE], storage))
+    except Exception:
+        db_metrics.record("store_documents", time.perf_counter() - start, error=True)
+        logger.exception("Query store_documents failed")
+        raise
+    _record("store_documents", start, copy_sql, (), rows=len(docs))
+    return ids
+
+def delete_collection_documents(collection_id):
+    run_statement("delete_collection_documents", (collection_id,), fetch=None)
 
 def get_document(doc_id):
+    return run_statement("get_document", (doc_id,), fetch="one")
+
+def count_collection_documents(collection_id):
+    return run_statement("count_collection_documents", (collection_id,), fetch="value")
+
+def get_chunk_set_version(collection_id):
+    """
+    Version of the set of chunks of a collection, used to validate its persisted index (see index_store.py).
+    """
+    return run_statement("get_chunk_set_version", (collection_id,), fetch="value")
+
+def iter_collection_documents(collection_id, batch_size=FETCH_BATCH_SIZE):
+    """
+    Stream the chunks of a collection in column-wise batches: {"collection_id", "ids", "texts", "file_ids",
+    "start_indexes", "embeddings"}, with the embeddings of each batch as a float32 (n, dim) matrix.
+    """
+    storage = RAG["EMBEDDING_STORAGE"]
     q = (
-        f"SELECT doc.id as id, doc.content as text, doc.start_index as offset, file.id as file_id, file.name as file_title, file.text as file_text "
-        "FROM Document as doc INNER JOIN Fitxategia as file ON doc.file_id = file.id WHERE doc.id=%s;"
+        f"SELECT doc.id, doc.content, doc.file_id, doc.start_index, {EMBEDDING_SELECT[storage]} FROM Document AS doc "
+        "INNER JOIN Fitxategia as f ON doc.file_id = f.id WHERE f.bilduma_key=%s ORDER BY doc.id"
     )
-    res = query_db_as_dict(q, (doc_id,))
-    print(res)
-    if len(res) == 0:
-        return None
-    return res[0]
+    for rows in fetch_batches(q, (collection_id,), row_factory="tuple", batch_size=batch_size, statement="iter_collection_documents"):
+        ids, texts, file_ids, start_indexes, embeddings = zip(*rows)
+        yield {
+            "collection_id": collection_id,
+            "ids": list(ids),
+            "texts": list(texts),
+            "file_ids": list(file_ids),
+            "start_indexes": list(start_indexes),
+            "embeddings": embedding_matrix(list(embeddings), storage),
+        }
 
 def retrieve_collection_documents(collection_id):
-    q = "SELECT doc.id AS id, doc.content AS content, doc.embedding AS emb, f.bilduma_key AS collection_id FROM Document AS doc INNER JOIN Fitxategia as f ON doc.file_id = f.id WHERE f.bilduma_key=%s"
-    return query_db_as_dict(q, (collection_id,))
+    """
+    All the chunks of a collection in a single column-wise batch (see iter_collection_documents).
+    """
+    ids, texts, embeddings = [], [], []
+    for batch in iter_collection_documents(collection_id):
+        ids.extend(batch["ids"])
+        texts.extend(batch["texts"])
+        embeddings.append(batch["embeddings"])
+    return {
+        "collection_id": collection_id,
+        "ids": ids,
+        "texts": texts,
+        "embeddings": np.concatenate(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32),
+    }
 
 ###################################################################################
     ###########################      NOTAK       #############################
 ###################################################################################
 
 def get_notes(collection_id):
-    sql = f"SELECT id, status, name, content, type, contained_file_ids, created_at::TEXT AS created_at FROM Note WHERE bilduma_key = {collection_id};"
-    return query_db_as_dict(sql)
+    return run_statement("get_notes", (collection_id,))
 
 def get_note(note_id):
-    sql = f"SELECT id, status, name, content, type, contained_file_ids, created_at::TEXT AS created_at FROM Note WHERE id = {note_id};"
-    res = query_db_as_dict(sql)
-    if len(res) == 0:
+    res = run_statement("get_note", (note_id,), fetch="one")
+    if res is None:
         return None
-    if res[0]["status"] == 0:
+    if res["status"] == 0:
         return False
-    elif res[0]["status"] == 2:
+    elif res["status"] == 2:
         raise RuntimeError("Note generation failed")
-    return res[0]
+    return res
 
 def ezabatu_nota(id):
-    q = f"DELETE FROM Note WHERE id = {id};"
-    commit_query_db(q)
+    run_statement("ezabatu_nota", (id,), fetch=None)
 
 def create_empty_note(note_type, collection_id, file_ids):
-    print('NOTEEEEE: ', str(file_ids))
-    sql = f"INSERT INTO Note (status, name, type, content, contained_file_ids, bilduma_key) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id"
-    data = (0, "", note_type, "", file_ids, collection_id)
-    return commit_query_db(sql, data)
+    return run_statement("create_empty_note", (note_type, file_ids, collection_id), fetch="value")
 
 def update_note(note_id, name, content):
-    sql = f"UPDATE Note SET status = %s, name = %s, content = %s WHERE id = %s"
-    data = (1, name, content, note_id)
-    commit_query_db(sql, data)
+    run_statement("update_note", (name, content, note_id), fetch=None)
 
 def fail_note(note_id):
-    sql = f"UPDATE Note SET status = %s WHERE id = %s"
-    data = (2, note_id)
-    commit_query_db(sql, data)
+    run_statement("fail_note", (note_id,), fetch=None)
+
+def import_note(collection_id, note):
+    """
+    Insert a complete note (e.g. from a collection bundle) and return its id.
+    """
+    params = (note["status"], note["name"], note["type"], note["content"], note["created_at"], note["contained_file_ids"], collection_id)
+    return run_statement("import_note", params, fetch="value")
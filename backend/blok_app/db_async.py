@@ -0,0 +1,227 @@
+"""
+    Asyncio version of the queries of db.py run by the Sanic handlers.
+    The blocking db.py stays the only path for the thread-pool tasks (tasks.py, ingestion), including the chunk COPY loader.
+"""
+import asyncpg
+import time
+from sanic.exceptions import BadRequest
+from backend.config import DATABASE
+import backend.blok_app.db_metrics as db_metrics
+
+_pool = None
+
+###################################################################################
+    #########################      GENERIKOAK       ############################
+###################################################################################
+
+async def init_pool():
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            host=DATABASE["host"],
+            port=int(DATABASE["port"]),
+            user=DATABASE["user"],
+            password=DATABASE["password"],
+            database=DATABASE["name"],
+            min_size=DATABASE["ASYNC_POOL_MIN"],
+            max_size=DATABASE["ASYNC_POOL_MAX"],
+            max_inactive_connection_lifetime=DATABASE["POOL_MAX_AGE"],
+        )
+    return _pool
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+def pool_metrics():
+    if _pool is None:
+        return {}
+    return {
+        "connections": _pool.get_size(),
+        "idle": _pool.get_idle_size(),
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+    }
+
+async def _explain(conn, sql, args):
+    try:
+        return "\n".join( row[0] for row in await conn.fetch(f"EXPLAIN {sql}", *args) )
+    except asyncpg.PostgresError as exc:
+        return f"EXPLAIN failed: {exc}"
+
+async def _record(statement, start, pool_wait, sql, args, conn, rows=(), nrows=None):
+    """
+    Record a call in db_metrics and log it if it was slow, with its EXPLAIN output.
+    """
+    seconds = time.perf_counter() - start
+    db_metrics.record(
+        statement, seconds, rows=len(rows) if nrows is None else nrows,
+        nbytes=db_metrics.rows_size(rows), pool_wait=pool_wait,
+    )
+    if db_metrics.is_slow(seconds):
+        plan = await _explain(conn, sql, args) if db_metrics.should_explain(statement, seconds) else None
+        db_metrics.log_slow(statement, sql, args, seconds, plan)
+
+async def query_db_as_dict(sql, *args, statement="query_db"):
+    """
+    asyncpg prepares the statements and caches them per connection; calls are recorded per statement name in db_metrics.
+    """
+    pool = await init_pool()
+    start = time.perf_counter()
+    try:
+        async with pool.acquire() as conn:
+            pool_wait = time.perf_counter() - start
+            rows = [ dict(row) for row in await conn.fetch(sql, *args) ]
+            await _record(statement, start, pool_wait, sql, args, conn, rows)
+    except Exception:
+        db_metrics.record(statement, time.perf_counter() - start, error=True)
+        raise
+    return rows
+
+async def commit_query_db(sql, *args, statement="commit_query_db"):
+    """
+    Run a modifying statement; returns the first column of its first row (e.g. RETURNING id), if any.
+    """
+    pool = await init_pool()
+    start = time.perf_counter()
+    try:
+        async with pool.acquire() as conn:
+            pool_wait = time.perf_counter() - start
+            async with conn.transaction():
+                result = await conn.fetchval(sql, *args)
+            await _record(statement, start, pool_wait, sql, args, conn, nrows=int(result is not None))
+    except Exception:
+        db_metrics.record(statement, time.perf_counter() - start, error=True)
+        raise
+    return result
+
+###################################################################################
+   ###########################      BILDUMAK       #############################
+###################################################################################
+
+LIST_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 500
+
+def _int_param(value, name):
+    """
+    Integer value of a request parameter (None if missing); BadRequest if it is not an integer.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"Invalid {name}: {value!r}")
+
+def _page_size(limit):
+    limit = _int_param(limit, "limit")
+    return min(max(limit or LIST_PAGE_SIZE, 1), LIST_MAX_PAGE_SIZE)
+
+def _page(rows, limit):
+    """
+    Keyset page: the rows plus the cursor (last id) to request the next page with, or None on the last page.
+    """
+    return {"items": rows, "next": rows[-1]["id"] if len(rows) == limit else None}
+
+async def get_bildumak(after=None, limit=None):
+    """
+    Page of collections, oldest first (the order the frontend lists them in), with metadata only (no summary): fetch a collection's body with get_bilduma.
+    """
+    limit = _page_size(limit)
+    sql = (
+        "SELECT B.id, B.name, B.title, B.create_date::TEXT AS c_date, B.update_date::TEXT AS u_date, "
+        "COALESCE(octet_length(B.summary), 0) AS summary_size, "
+        "(SELECT COUNT(*) FROM Fitxategia AS F WHERE F.bilduma_key = B.id) AS fitxategia_count "
+        "FROM Bilduma AS B WHERE $1::BIGINT IS NULL OR B.id > $1 ORDER BY B.id LIMIT $2"
+    )
+    rows = await query_db_as_dict(sql, _int_param(after, "after"), limit, statement="get_bildumak")
+    return _page(rows, limit)
+
+async def get_bilduma(id):
+    sql = "SELECT id, name, title, summary, create_date::TEXT AS c_date, update_date::TEXT AS u_date FROM Bilduma WHERE id = $1"
+    return (await query_db_as_dict(sql, int(id), statement="get_bilduma"))[0]
+
+async def create_bilduma(args):
+    q = "INSERT INTO Bilduma (id, name, create_date, update_date) VALUES ($1, $2, $3::TEXT::DATE, $3::TEXT::DATE)"
+    await commit_query_db(q, int(args["id"]), args["title"], args["date"], statement="create_bilduma")
+
+async def delete_bilduma(args):
+    q = "DELETE FROM Bilduma WHERE id = $1"
+    await commit_query_db(q, int(args["id"]), statement="delete_bilduma")
+
+async def rename_bilduma(args):
+    q = "UPDATE Bilduma SET name = $1, update_date = CURRENT_DATE WHERE id = $2"
+    await commit_query_db(q, args["title"], int(args["id"]), statement="rename_bilduma")
+
+async def set_chat_id(nt_id, chat_id):
+    q = "UPDATE Bilduma SET chat_id = $1::TEXT::UUID WHERE id = $2"
+    await commit_query_db(q, str(chat_id), int(nt_id), statement="set_chat_id")
+
+###################################################################################
+  ########################       FITXATEGIAK        #############################
+###################################################################################
+
+async def get_fitxategiak(collection_id, content=False, file_ids=[]):
+    args = [int(collection_id)]
+    filter_files = ""
+    if file_ids:
+        filter_files = "AND id = ANY($2)"
+        args.append([ int(fid) for fid in file_ids ])
+    select_content = ", text" if content else ""
+    sql = f"SELECT id, name, format, charNum AS \"charNum\" {select_content} FROM Fitxategia WHERE bilduma_key = $1 {filter_files}"
+    return await query_db_as_dict(sql, *args, statement="get_fitxategiak")
+
+async def get_fitxategia(id):
+    sql = "SELECT id, name, text, charNum AS \"charNum\", format FROM Fitxategia WHERE id = $1"
+    return (await query_db_as_dict(sql, int(id), statement="get_fitxategia"))[0]
+
+async def get_document(doc_id):
+    q = (
+        "SELECT doc.id as id, doc.content as text, doc.start_index as offset, file.id as file_id, file.name as file_title, file.text as file_text "
+        "FROM Document as doc INNER JOIN Fitxategia as file ON doc.file_id = file.id WHERE doc.id = $1"
+    )
+    res = await query_db_as_dict(q, int(doc_id), statement="get_document")
+    if len(res) == 0:
+        return None
+    return res[0]
+
+###################################################################################
+    ###########################      NOTAK       #############################
+###################################################################################
+
+async def get_notes(collection_id, after=None, limit=None):
+    """
+    Page of the notes of a collection, oldest first, with metadata only: fetch a note's content with get_note.
+    """
+    limit = _page_size(limit)
+    sql = (
+        "SELECT id, status, name, type, contained_file_ids, created_at::TEXT AS created_at, octet_length(content) AS content_size "
+        "FROM Note WHERE bilduma_key = $1 AND ($2::BIGINT IS NULL OR id > $2) ORDER BY id LIMIT $3"
+    )
+    rows = await query_db_as_dict(sql, _int_param(collection_id, "collection id"), _int_param(after, "after"), limit, statement="get_notes")
+    return _page(rows, limit)
+
+async def get_note(note_id):
+    sql = "SELECT id, status, name, content, type, contained_file_ids, created_at::TEXT AS created_at FROM Note WHERE id = $1"
+    res = await query_db_as_dict(sql, int(note_id), statement="get_note")
+    if len(res) == 0:
+        return None
+    if res[0]["status"] == 0:
+        return False
+    elif res[0]["status"] == 2:
+        raise RuntimeError("Note generation failed")
+    return res[0]
+
+async def ezabatu_nota(id):
+    q = "DELETE FROM Note WHERE id = $1"
+    await commit_query_db(q, int(id), statement="ezabatu_nota")
+
+async def create_empty_note(note_type, collection_id, file_ids):
+    sql = "INSERT INTO Note (status, name, type, content, contained_file_ids, bilduma_key) VALUES ($1, $2, $3, $4, $5, $6) RETURNING id"
+    return await commit_query_db(sql, 0, "", note_type, "", [ int(fid) for fid in file_ids ], int(collection_id), statement="create_empty_note")
+
+async def fail_note(note_id):
+    sql = "UPDATE Note SET status = $1 WHERE id = $2"
+    await commit_query_db(sql, 2, int(note_id), statement="fail_note")
@@ -0,0 +1,145 @@
+from backend.config import DATABASE
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# String arguments longer than this are logged as their length only (note contents, file texts...)
+MAX_LOGGED_STRING = 64
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket counts everything slower
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_statements = {}  # statement name -> counters and latency histogram
+_slow_queries = collections.deque(maxlen=DATABASE["SLOW_QUERY_LOG_SIZE"])
+_last_explain = {}  # statement name -> time of its last EXPLAIN
+
+def _new_stats():
+    return {
+        "calls": 0,
+        "errors": 0,
+        "rows": 0,
+        "bytes": 0,
+        "seconds_total": 0.0,
+        "seconds_max": 0.0,
+        "pool_wait_seconds_total": 0.0,
+        "slow": 0,
+        "histogram": [0] * (len(LATENCY_BUCKETS) + 1),
+    }
+
+def _bucket(seconds):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+def value_size(value):
+    """
+    Approximate size in bytes of a value returned by the database.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, memoryview, str)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(value_size(v) for v in value.values())
+    return 8
+
+def rows_size(rows):
+    return sum(value_size(row) for row in rows)
+
+def record(name, seconds, error=False, rows=0, nbytes=0, pool_wait=0.0):
+    """
+    Add a call of the statement to its counters and latency histogram.
+    """
+    with _lock:
+        stats = _statements.get(name)
+        if stats is None:
+            stats = _statements[name] = _new_stats()
+        stats["calls"] += 1
+        stats["errors"] += int(error)
+        stats["rows"] += rows
+        stats["bytes"] += nbytes
+        stats["seconds_total"] += seconds
+        stats["seconds_max"] = max(stats["seconds_max"], seconds)
+        stats["pool_wait_seconds_total"] += pool_wait
+        stats["histogram"][_bucket(seconds)] += 1
+        if is_slow(seconds):
+            stats["slow"] += 1
+
+def is_slow(seconds):
+    threshold = DATABASE["SLOW_QUERY_MS"]
+    return threshold > 0 and seconds * 1000 >= threshold
+
+def should_explain(name, seconds):
+    """
+    Whether a slow call should be EXPLAINed: at most once per statement every SLOW_QUERY_EXPLAIN_INTERVAL seconds.
+    """
+    if not DATABASE["SLOW_QUERY_EXPLAIN"] or not is_slow(seconds):
+        return False
+    now = time.time()
+    with _lock:
+        if now - _last_explain.get(name, 0.0) < DATABASE["SLOW_QUERY_EXPLAIN_INTERVAL"]:
+            return False
+        _last_explain[name] = now
+    return True
+
+def _redact(value):
+    """
+    The value with its long strings and binary values replaced by a placeholder, to log it without its content.
+    """
+    if isinstance(value, str) and len(value) > MAX_LOGGED_STRING:
+        return f"<text: {len(value)} chars>"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<binary: {len(value)} bytes>"
+    if isinstance(value, (list, tuple)):
+        return type(value)( _redact(v) for v in value )
+    if isinstance(value, dict):
+        return { k: _redact(v) for k, v in value.items() }
+    return value
+
+def log_slow(name, sql, args, seconds, plan=None):
+    """
+    Log a slow statement (with its query plan, if it was EXPLAINed) and keep it for the metrics endpoint.
+    """
+    args_repr = repr(_redact(args))
+    entry = {
+        "statement": name,
+        "seconds": seconds,
+        "at": time.time(),
+        "sql": sql,
+        "args": args_repr,
+        "plan": plan,
+    }
+    with _lock:
+        _slow_queries.append(entry)
+    message = f"Slow query {name} ({seconds * 1000:.0f} ms): {sql} {args_repr}"
+    if plan:
+        message += "\n" + plan
+    logger.warning(message)
+
+def statements():
+    """
+    Per statement: calls, errors, rows, bytes returned, timings and pool wait (seconds), and the latency histogram
+    as {bucket upper bound: count}.
+    """
+    bounds = [ str(bound) for bound in LATENCY_BUCKETS ] + ["+Inf"]
+    with _lock:
+        return {
+            name: {
+                **{ k: v for k, v in stats.items() if k != "histogram" },
+                "seconds_avg": stats["seconds_total"] / stats["calls"] if stats["calls"] else 0.0,
+                "histogram": dict(zip(bounds, stats["histogram"])),
+            }
+            for name, stats in _statements.items()
+        }
+
+def slow_queries():
+    with _lock:
+        return list(_slow_queries)
@@ -1,4 +1,8 @@
 from backend.blok_app.audio_process import extract_text_from_audio
+import backend.blok_app.office_converter as office_converter
+import backend.blok_app.parse_cache as parse_cache
+from backend.blok_app.uploads import file_path, file_source, iter_file_chunks
+from backend.config import PARSER, ASR, LLM
 
 from collections import namedtuple
 import os
@@ -7,13 +11,17 @@ import io
 import chardet
 import tempfile
 from pdb import set_trace as d
-import subprocess
+import struct
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 
 
 from pathlib import Path
 import olefile
 import docx2txt
+import pypdfium2 as pdfium
 from docx import Document
 import time
 from docling.datamodel.accelerator_options import AcceleratorDevice, AcceleratorOptions
@@ -32,6 +40,29 @@ from docling.pipeline.simple_pipeline import SimplePipeline
 from docling.pipeline.standard_pdf_pipeline import StandardPdfPipeline
 from docling.datamodel.settings import settings
 
+# Enable the profiling to measure the time spent
+settings.debug.profile_pipeline_timings = True
+
+# Docling converters load the layout, OCR and table-structure models when their pipelines are initialized:
+# build them once per process and pipeline configuration, and share them between requests
+_converters = {}
+_converters_lock = threading.Lock()
+_converter_build_locks = {}  # one per pipeline configuration: building one does not hold up the others
+_converter_stats_lock = threading.Lock()
+_conversion_slots = threading.BoundedSemaphore(PARSER["MAX_CONVERSIONS"])
+converter_stats = {
+    "init_count": 0,
+    "init_seconds": 0.0,
+    "convert_count": 0,
+    "convert_seconds": 0.0,
+}
+# Worker pool of each parser bucket (see extract_from_documents)
+_bucket_executors = {}
+_bucket_executors_lock = threading.Lock()
+# Page-range conversion of large PDFs: each worker process keeps its own warm converter
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
 class SanicFileAdapter:
     """
     Adapts a Sanic File object so it can be consumed by
@@ -79,53 +110,406 @@ def extract_from_documents(files) -> list[dict]:
             'error': str (if success=False)
         }
     """
-    ocr_list = []
-    doc_list = []
-    audio_list = []
-    manual_list = []
-    for f in files:
-        f_type = f.type.lower().split('/')[-1]
-        if f_type in ['pdf', 'vnd.openxmlformats-officedocument.wordprocessingml.document']:
-            ocr_list.append(f)
-        elif f_type in ['ms-doc', 'doc', 'msword']:
-            doc_list.append(f)
-        elif f_type in ['mpeg', 'x-mpeg-3', 'wav', 'x-wav']:
-            audio_list.append(f)
-        else:
-            manual_list.append(f)
-
-    return_list = list(map(extract_text_from_document, manual_list))
-    return_list += extract_text_from_documents_DOC(doc_list)
-    return_list += extract_text_from_documents_with_ocr(ocr_list)
-    return_list += list(map(extract_text_from_audio, audio_list))
-
+    return_list = [None] * len(files)
+    for i, res in iter_extract_from_documents(files):
+        return_list[i] = res
     return return_list
 
+def _get_bucket_executor(bucket):
+    with _bucket_executors_lock:
+        if bucket not in _bucket_executors:
+            _bucket_executors[bucket] = ThreadPoolExecutor(max_workers=PARSER["WORKERS"][bucket], thread_name_prefix=f"parser-{bucket}")
+    return _bucket_executors[bucket]
+
+def _failed_result(file, error):
+    return {
+        'success': False,
+        'text': '',
+        'filename': file.name,
+        'file_type': Path(file.name).suffix.lower(),
+        'error': error
+    }
+
+def iter_extract_from_documents(files):
+    """
+    Same as extract_from_documents, but yields (index in files, result) as soon as each file is parsed.
+    The buckets (TXT/SRT, DOC, PDF/DOCX, audio) run concurrently, each one in its own worker pool.
+    """
+    # Already parsed files (same bytes, same parser configuration) are read from the cache
+    buckets = { bucket: [] for bucket in _BUCKET_PARSERS }
+    cache_keys = {}
+    for i, f in enumerate(files):
+        bucket = _parser_bucket(f)
+        key = parse_cache.make_key(iter_file_chunks(f), bucket, _parser_fingerprint(bucket))
+        cached = parse_cache.get(key)
+        if cached is not None:
+            print('Parsed text found in cache: ', f.name)
+            yield i, dict(cached, filename=f.name)
+            continue
+        cache_keys[i] = key
+        buckets[bucket].append(i)
+
+    # Batch parsers get all their files in one task, the others one task per file
+    futures = {}
+    for bucket, idxs in buckets.items():
+        if not idxs:
+            continue
+        executor = _get_bucket_executor(bucket)
+        tasks = [idxs] if bucket in _BATCH_BUCKETS else [ [i] for i in idxs ]
+        for task_idxs in tasks:
+            future = executor.submit(_BUCKET_PARSERS[bucket], [ files[i] for i in task_idxs ])
+            futures[future] = task_idxs
+
+    for future in as_completed(futures):
+        task_idxs = futures[future]
+        try:
+            parsed = future.result()
+        except Exception as e:
+            print('Error while parsing files: ', e)
+            parsed = [ _failed_result(files[i], f'Error processing file: {str(e)}') for i in task_idxs ]
+        for i, res in zip(task_idxs, parsed):
+            if res['success']:
+                parse_cache.put(cache_keys[i], res)
+            yield i, res
+
+def _parser_bucket(f):
+    f_type = f.type.lower().split('/')[-1]
+    if f_type in ['pdf', 'vnd.openxmlformats-officedocument.wordprocessingml.document']:
+        return 'ocr'
+    elif f_type in ['ms-doc', 'doc', 'msword']:
+        return 'doc'
+    elif f_type in ['mpeg', 'x-mpeg-3', 'wav', 'x-wav']:
+        return 'audio'
+    return 'manual'
+
+# Bump when a parser changes its output, to invalidate the cached texts
+_PARSER_VERSIONS = {
+    'manual': 1,
+    'doc': 1,
+    'ocr': 1,
+    'audio': 1,
+}
+
+def _parser_fingerprint(bucket):
+    """
+    Configuration affecting the text extracted by each parser.
+    """
+    if bucket == 'manual':
+        config = ()
+    elif bucket == 'audio':
+        config = (ASR["EU"], ASR["ES"], ASR["LANG_ID"], LLM["MODEL_ID"])
+    else:
+        config = (
+            _converter_key()[2:],
+            PARSER["TEXT_LAYER_FAST_PATH"],
+            PARSER["TEXT_LAYER_MIN_CHARS"],
+            PARSER["TEXT_LAYER_MIN_COVERAGE"],
+            PARSER["TEXT_LAYER_MAX_GARBAGE"],
+        )
+    return f"v{_PARSER_VERSIONS[bucket]}:{config}"
+
 def extract_text_from_documents_DOC(files):
+    emaitz = [None] * len(files)
+    fallback = []
     converted_list = []
     FakeSanicFile = namedtuple('FakeSanicFile', 'body name type')
     
-    for file in files:
+    for i, file in enumerate(files):
         print('Extract text from DOC files:', file.name)
 
-        pdf_bytes = doc_bytes_to_pdf_bytes(file.body)
-
-        converted_list.append(FakeSanicFile(            
-                    body=pdf_bytes,
-                    name=file.name.replace('.doc', '.pdf'),
-                    type='application/pdf')
-        )
+        # Read the text stored in the Word binary file; LibreOffice + OCR only for the files it cannot read
+        try:
+            emaitz[i] = {
+                'success': True,
+                'text': extract_doc_text(file_source(file)),
+                'filename': file.name,
+                'file_type': 'DOC',
+                'error': ''
+            }
+            continue
+        except Exception as e:
+            print(f'Native DOC extraction failed for {file.name}, converting it with LibreOffice: {e}')
+        fallback.append(i)
+
+    # Convert all the remaining files in a single batch of the LibreOffice service (only started when needed)
+    if fallback:
+        try:
+            pdfs_bytes = office_converter.convert_to_pdf([ file_source(files[i]) for i in fallback ])
+        except Exception as e:
+            # Keep the texts read natively; only the files to convert fail
+            print(f'LibreOffice conversion of DOC files failed: {e}')
+            for i in fallback:
+                emaitz[i] = {'success': False, 'text': '', 'filename': files[i].name, 'file_type': 'DOC', 'error': str(e)}
+            return emaitz
+        for i, pdf_bytes in zip(fallback, pdfs_bytes):
+            converted_list.append(FakeSanicFile(
+                        body=pdf_bytes,
+                        name=files[i].name.replace('.doc', '.pdf'),
+                        type='application/pdf')
+            )
 
-    emaitz =  [{
-    'success': f['success'],
-    'text': f['text'],
-    'filename': f['filename'].replace(".pdf", ".doc"),
-    'file_type': 'DOC',
-    'error': f['error']
-            } for f in extract_text_from_documents_with_ocr(converted_list)]
+        for i, f in zip(fallback, extract_text_from_documents_with_ocr(converted_list)):
+            emaitz[i] = {
+        'success': f['success'],
+        'text': f['text'],
+        'filename': f['filename'].replace(".pdf", ".doc"),
+        'file_type': 'DOC',
+        'error': f['error']
+                }
 
     return emaitz
 
+# Word 97-2003 (.doc) special characters
+_DOC_FIELD_BEGIN = '\x13'
+_DOC_FIELD_SEPARATOR = '\x14'
+_DOC_FIELD_END = '\x15'
+_DOC_CHAR_MAP = {
+    '\r': '\n',    # paragraph end
+    '\x0b': '\n',  # line break
+    '\x0c': '\n',  # page / section break
+    '\x07': '\t',  # table cell / row end
+    '\x1e': '-',   # non-breaking hyphen
+    '\x1f': '',    # optional hyphen
+}
+
+def _clean_doc_text(text):
+    """
+    Keep the displayed text of a Word document: drop field codes (keeping their results) and control characters.
+    """
+    out = []
+    fields = []  # one entry per open field: True while reading its code, False while reading its result
+    for ch in text:
+        if ch == _DOC_FIELD_BEGIN:
+            fields.append(True)
+        elif ch == _DOC_FIELD_SEPARATOR:
+            if fields:
+                fields[-1] = False
+        elif ch == _DOC_FIELD_END:
+            if fields:
+                fields.pop()
+        elif any(fields):
+            continue
+        elif ch in _DOC_CHAR_MAP:
+            out.append(_DOC_CHAR_MAP[ch])
+        elif ch >= ' ' or ch in '\t\n':
+            out.append(ch)
+    return ''.join(out)
+
+def extract_doc_text(doc_source) -> str:
+    """
+    Extract the main document text of a Word 97-2003 binary file (bytes or path) from its WordDocument and table streams (piece table).
+    Raises ValueError for files it cannot read (not OLE, encrypted, no piece table...).
+    """
+    if not olefile.isOleFile(doc_source):
+        raise ValueError('Not an OLE compound file')
+    with olefile.OleFileIO(doc_source) as ole:
+        if not ole.exists('WordDocument'):
+            raise ValueError('WordDocument stream not found')
+        word = ole.openstream('WordDocument').read()
+
+        # FibBase
+        w_ident, n_fib = struct.unpack_from('<HH', word, 0)
+        if w_ident != 0xA5EC:
+            raise ValueError('Invalid Word document signature')
+        flags = struct.unpack_from('<H', word, 0x0A)[0]
+        if flags & 0x0100:
+            raise ValueError('Encrypted document')
+        table_name = '1Table' if flags & 0x0200 else '0Table'
+        if not ole.exists(table_name):
+            raise ValueError(f'{table_name} stream not found')
+        table = ole.openstream(table_name).read()
+
+    # FibRgW97, FibRgLw97 and FibRgFcLcb97 follow the 32-byte FibBase, each one preceded by its size
+    pos = 32
+    csw = struct.unpack_from('<H', word, pos)[0]
+    pos += 2 + csw * 2
+    cslw = struct.unpack_from('<H', word, pos)[0]
+    ccp_text = struct.unpack_from('<i', word, pos + 2 + 3 * 4)[0]  # main document length, in characters
+    pos += 2 + cslw * 4
+    pos += 2  # cbRgFcLcb
+    fc_clx, lcb_clx = struct.unpack_from('<II', word, pos + 33 * 8)
+    if lcb_clx == 0 or fc_clx + lcb_clx > len(table):
+        raise ValueError('Piece table not found')
+    clx = table[fc_clx:fc_clx + lcb_clx]
+
+    # Clx: skip the Prc entries, then read the Pcdt (PlcPcd: n+1 CPs followed by n 8-byte piece descriptors)
+    pos = 0
+    while pos < len(clx) and clx[pos] == 0x01:
+        pos += 3 + struct.unpack_from('<H', clx, pos + 1)[0]
+    if pos >= len(clx) or clx[pos] != 0x02:
+        raise ValueError('Invalid piece table')
+    lcb = struct.unpack_from('<I', clx, pos + 1)[0]
+    plc_pcd = clx[pos + 5:pos + 5 + lcb]
+    n_pieces = (lcb - 4) // 12
+    cps = struct.unpack_from(f'<{n_pieces + 1}I', plc_pcd, 0)
+
+    pieces = []
+    for i in range(n_pieces):
+        fc = struct.unpack_from('<I', plc_pcd, 4 * (n_pieces + 1) + 8 * i + 2)[0]
+        n_chars = cps[i + 1] - cps[i]
+        if fc & 0x40000000:
+            # 8-bit characters (cp1252) at fc / 2
+            start = (fc & 0x3FFFFFFF) // 2
+            pieces.append(word[start:start + n_chars].decode('cp1252', errors='replace'))
+        else:
+            # UTF-16LE characters at fc
+            start = fc & 0x3FFFFFFF
+            pieces.append(word[start:start + 2 * n_chars].decode('utf-16-le', errors='replace'))
+
+    text = _clean_doc_text(''.join(pieces)[:ccp_text]).strip()
+    if not text:
+        raise ValueError('No text found')
+    return text
+
+PageText = namedtuple('PageText', 'needs_ocr text')
+
+def _is_pdf(file):
+    return file.type.lower().endswith('pdf') or file.name.lower().endswith('.pdf')
+
+def _document_source(file):
+    """
+    Docling input for an uploaded file: its path when it is spooled to disk, otherwise an in-memory stream.
+    """
+    path = file_path(file)
+    if path is not None:
+        return Path(path)
+    return DocumentStream(name=file.name, stream=io.BytesIO(file.body))
+
+def classify_pdf_pages(pdf_source) -> list:
+    """
+    Check the embedded text layer of every page of a PDF (bytes or path).
+    Returns a PageText per page: pages with enough readable text keep it, scanned or image-only pages need OCR.
+    """
+    pages = []
+    pdf = pdfium.PdfDocument(pdf_source)
+    try:
+        for page in pdf:
+            textpage = page.get_textpage()
+            text = textpage.get_text_range().replace('\r\n', '\n').replace('\r', '\n')
+            visible = [ c for c in text if not c.isspace() ]
+            garbage = sum(1 for c in visible if c == '\ufffd' or not c.isprintable())
+            width, height = page.get_size()
+            text_area = 0.0
+            for i in range(textpage.count_rects()):
+                left, bottom, right, top = textpage.get_rect(i)
+                text_area += abs(right - left) * abs(top - bottom)
+            coverage = text_area / (width * height) if width and height else 0.0
+            needs_ocr = (
+                len(visible) < PARSER["TEXT_LAYER_MIN_CHARS"]
+                or coverage < PARSER["TEXT_LAYER_MIN_COVERAGE"]
+                or garbage > PARSER["TEXT_LAYER_MAX_GARBAGE"] * len(visible)
+            )
+            pages.append(PageText(needs_ocr, '' if needs_ocr else text.strip()))
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+    return pages
+
+def _page_runs(pages):
+    """
+    Group consecutive pages by whether they need OCR: [(needs_ocr, first, last), ...] with 1-based page numbers.
+    """
+    runs = []
+    for page_no, page in enumerate(pages, start=1):
+        if runs and runs[-1][0] == page.needs_ocr:
+            runs[-1][2] = page_no
+        else:
+            runs.append([page.needs_ocr, page_no, page_no])
+    return [ tuple(run) for run in runs ]
+
+def _text_result(file, text):
+    return {
+        'success': True,
+        'text': text,
+        'filename': file.name,
+        'file_type': Path(file.name).suffix.lower(),
+        'error': ''
+    }
+
+def _init_range_worker():
+    # Workers convert their page ranges on their own device/threads, and load the models before the first range
+    PARSER["DEVICE"] = PARSER["PARALLEL_DEVICE"]
+    PARSER["NUM_THREADS"] = PARSER["PARALLEL_THREADS"]
+    get_converter()
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PARSER["PARALLEL_WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_range_worker,
+            )
+    return _process_pool
+
+def shutdown_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(cancel_futures=True)
+            _process_pool = None
+
+def _use_parallel_conversion(n_pages):
+    return PARSER["PARALLEL_WORKERS"] > 1 and n_pages >= PARSER["PARALLEL_MIN_PAGES"]
+
+def _page_ranges(first, last, size):
+    return [ (start, min(start + size - 1, last)) for start in range(first, last + 1, size) ]
+
+def _convert_range_worker(pdf_path, first, last):
+    """
+    Convert a page range of a PDF in a worker process. Returns the markdown and the Docling profiling timings.
+    """
+    res = get_converter().convert(Path(pdf_path), page_range=(first, last))
+    timings = { key: sum(item.times) for key, item in res.timings.items() }
+    return res.document.export_to_markdown(), timings
+
+def _convert_pdf_pages_parallel(file, first, last):
+    parts = []
+    with tempfile.TemporaryDirectory() as td:
+        # Workers read the PDF from disk instead of receiving a copy of its bytes per range
+        pdf_path = file_path(file)
+        if pdf_path is None:
+            pdf_path = Path(td) / "in.pdf"
+            pdf_path.write_bytes(file.body)
+        ranges = _page_ranges(first, last, PARSER["PAGE_RANGE_SIZE"])
+        start = time.time()
+        pool = _get_process_pool()
+        futures = [ pool.submit(_convert_range_worker, str(pdf_path), range_first, range_last) for range_first, range_last in ranges ]
+        for (range_first, range_last), future in zip(ranges, futures):
+            md, timings = future.result()
+            print(f'Processing time OCR for pages {range_first}-{range_last} of {file.name}: {timings.get("pipeline_total", 0.0)}')
+            parts.append(md)
+        _record_converter_time("convert", time.time() - start)
+    return '\n\n'.join(part for part in parts if part)
+
+def _convert_pdf_pages(file, first, last):
+    """
+    OCR the given page range of a PDF and return it as markdown.
+    """
+    if _use_parallel_conversion(last - first + 1):
+        return _convert_pdf_pages_parallel(file, first, last)
+    doc_converter = get_converter()
+    with _conversion_slots:
+        start = time.time()
+        res = doc_converter.convert(_document_source(file), page_range=(first, last))
+        _record_converter_time("convert", time.time() - start)
+    return res.document.export_to_markdown()
+
+def _extract_pdf_by_pages(file, pages):
+    """
+    Read the text layer of the digital pages, OCR the rest, and merge everything back in page order.
+    """
+    parts = []
+    for needs_ocr, first, last in _page_runs(pages):
+        if needs_ocr:
+            print(f'Reading pages {first}-{last} of {file.name} with ocr')
+            parts.append(_convert_pdf_pages(file, first, last))
+        else:
+            parts.extend(page.text for page in pages[first - 1:last])
+    return _text_result(file, '\n\n'.join(part for part in parts if part))
+
 def extract_text_from_documents_with_ocr(files) -> list[dict]:
     
     processed_files = []
@@ -134,19 +518,90 @@ def extract_text_from_documents_with_ocr(files) -> list[dict]:
     # ERROR
     if not files:
         return processed_files
-    
-    formated_files = [DocumentStream(name= file.name, stream= io.BytesIO(file.body)) for file in files]
 
-    # Enable the profiling to measure the time spent
-    settings.debug.profile_pipeline_timings = True
+    try:
+        # Text-layer fast path: PDFs with at least one digital page skip the full OCR pipeline
+        processed_files = [None] * len(files)
+        ocr_files = []
+        for i, file in enumerate(files):
+            if _is_pdf(file):
+                if PARSER["TEXT_LAYER_FAST_PATH"]:
+                    pages = classify_pdf_pages(file_source(file))
+                    n_ocr = sum(1 for page in pages if page.needs_ocr)
+                    print(f'Text layer of {file.name}: {len(pages) - n_ocr} digital pages, {n_ocr} pages to OCR')
+                    if n_ocr < len(pages):
+                        processed_files[i] = _extract_pdf_by_pages(file, pages)
+                        continue
+                    n_pages = len(pages)
+                else:
+                    pdf = pdfium.PdfDocument(file_source(file))
+                    n_pages = len(pdf)
+                    pdf.close()
+                # Large PDFs: convert page ranges in parallel
+                if _use_parallel_conversion(n_pages):
+                    processed_files[i] = _text_result(file, _convert_pdf_pages(file, 1, n_pages))
+                    continue
+            ocr_files.append(i)
+
+        formated_files = [_document_source(files[i]) for i in ocr_files]
+
+        conv_results = []
+        if formated_files:
+            doc_converter = get_converter()
+            with _conversion_slots:
+                start = time.time()
+                conv_results = list(doc_converter.convert_all(formated_files))
+                _record_converter_time("convert", time.time() - start)
+
+        # Global conversion row
+        for i, res in zip(ocr_files, conv_results):
+            p = res.input.file
+            print('Reading file with ocr: ', p.name)
+            
+            # Extract timing from ProfilingItem
+            try:
+                profiling_item = res.timings["pipeline_total"]
+                # The ProfilingItem has a 'times' list with the actual timing values
+                real_processing_time = profiling_item.times[0]
+                    
+            except Exception as e:
+                real_processing_time = 0.0
+
+            # export timing (still measured by us if you want it)
+            start = time.time()
+            md = res.document.export_to_markdown()
+            exp_time = time.time() - start
+            
+            print(f'Processing time OCR for file {p.name}: {real_processing_time}. And markdown export: {exp_time}')
+
+            processed_files[i] = {
+                'success': True,
+                'text': md,
+                'filename': p.name,
+                'file_type': p.suffix.lower(),
+                'error': ''
+            }
+    except Exception as e:
+        print('Error while processing files with OCR: ', e)
+        # One result per input file: the files not processed yet are reported as failed
+        processed_files = [ res if res is not None else _failed_result(file, f'Error processing file: {str(e)}')
+                            for res, file in zip(processed_files, files) ]
+
+    return processed_files
+
 
+
+def _converter_key(do_ocr=True, do_table_structure=True):
+    return (PARSER["DEVICE"], PARSER["NUM_THREADS"], do_ocr, do_table_structure)
+
+def _build_converter(device, num_threads, do_ocr, do_table_structure):
     ## ACC OPTIONS
     accelerator_options_CPU = AcceleratorOptions(
-        num_threads=8, device=AcceleratorDevice.CPU
+        num_threads=num_threads, device=AcceleratorDevice.CPU
     )
 
-    accelerator_options_GPU = AcceleratorOptions(
-        num_threads=8, device=AcceleratorDevice.CUDA
+    accelerator_options_PDF = AcceleratorOptions(
+        num_threads=num_threads, device=AcceleratorDevice(device)
     )
 
     # STANDARD CONFIG
@@ -154,9 +609,9 @@ def extract_text_from_documents_with_ocr(files) -> list[dict]:
 
     # SETTINGS PDF
     pipeline_options_pdf = PdfPipelineOptions()
-    pipeline_options_pdf.accelerator_options = accelerator_options_GPU
-    pipeline_options_pdf.do_ocr = True
-    pipeline_options_pdf.do_table_structure = True
+    pipeline_options_pdf.accelerator_options = accelerator_options_PDF
+    pipeline_options_pdf.do_ocr = do_ocr
+    pipeline_options_pdf.do_table_structure = do_table_structure
     pipeline_options_pdf.table_structure_options.do_cell_matching = True
 
     # DOC CONVERTER
@@ -176,45 +631,50 @@ def extract_text_from_documents_with_ocr(files) -> list[dict]:
                 },
             )
         )
-    conv_results = doc_converter.convert_all(formated_files)
+    # Load the models now instead of on the first conversion
+    doc_converter.initialize_pipeline(InputFormat.PDF)
+    doc_converter.initialize_pipeline(InputFormat.DOCX)
+    return doc_converter
 
+def _record_converter_time(kind, seconds):
+    with _converter_stats_lock:
+        converter_stats[f"{kind}_count"] += 1
+        converter_stats[f"{kind}_seconds"] += seconds
 
-    try:
-        # Global conversion row
-        for res in conv_results:
-            p = res.input.file
-            print('Reading file with ocr: ', p.name)
-            
-            # Extract timing from ProfilingItem
-            try:
-                profiling_item = res.timings["pipeline_total"]
-                # The ProfilingItem has a 'times' list with the actual timing values
-                real_processing_time = profiling_item.times[0]
-                    
-            except Exception as e:
-                real_processing_time = 0.0
+def converter_metrics():
+    with _converter_stats_lock:
+        return dict(converter_stats)
 
-            # export timing (still measured by us if you want it)
+def get_converter(do_ocr=True, do_table_structure=True):
+    """
+    Return the warm DocumentConverter for the given pipeline options, building it on first use.
+    """
+    key = _converter_key(do_ocr, do_table_structure)
+    with _converters_lock:
+        doc_converter = _converters.get(key, None)
+        if doc_converter is not None:
+            return doc_converter
+        build_lock = _converter_build_locks.setdefault(key, threading.Lock())
+    # Built outside _converters_lock: loading the models takes a while
+    with build_lock:
+        with _converters_lock:
+            doc_converter = _converters.get(key, None)
+        if doc_converter is None:
             start = time.time()
-            md = res.document.export_to_markdown()
-            exp_time = time.time() - start
-            
-            print(f'Processing time OCR for file {p.name}: {real_processing_time}. And markdown export: {exp_time}')
-
-            processed_files.append({
-                'success': True,
-                'text': md,
-                'filename': p.name,
-                'file_type': p.suffix.lower(),
-                'error': ''
-            })
-    except Exception as e:
-        print('Error while processing files with OCR: ', e)
-        return []
-
-    return processed_files
-
-
+            doc_converter = _build_converter(*key)
+            init_time = time.time() - start
+            _record_converter_time("init", init_time)
+            print(f'Docling converter {key} initialized in {init_time}')
+            with _converters_lock:
+                _converters[key] = doc_converter
+    return doc_converter
+
+def warm_converters():
+    """
+    Build the default converter at server start, so that the first upload does not pay for loading the models.
+    """
+    if PARSER["WARM_UP"]:
+        get_converter()
 
 def extract_text_from_document(file) -> dict:
     """
@@ -288,24 +748,19 @@ def extract_text_from_document(file) -> dict:
             'error': f'Error processing file: {str(e)}'
         }
 
+# Parser of each bucket of extract_from_documents
+_BUCKET_PARSERS = {
+    'manual': lambda files: list(map(extract_text_from_document, files)),
+    'doc': lambda files: extract_text_from_documents_DOC(files),
+    'ocr': lambda files: extract_text_from_documents_with_ocr(files),
+    'audio': lambda files: list(map(extract_text_from_audio, files)),
+}
+# PDF/DOCX files are converted one per task against the shared warm converter, so each one is yielded as soon as it is done
+_BATCH_BUCKETS = ('doc',)
+
 # DOC formatutik testua lortzeko
 def doc_bytes_to_pdf_bytes(doc_bytes: bytes) -> bytes:
-    with tempfile.TemporaryDirectory(dir='.') as td:
-        tdir = Path(td)
-        doc_path = tdir / "in.doc"
-        pdf_path = tdir / "in.pdf"
-
-        doc_path.write_bytes(doc_bytes)
-
-        subprocess.run([
-            "libreoffice",
-            "--headless",
-            "--convert-to", "pdf",
-            "--outdir", str(tdir),
-            str(doc_path)
-        ], check=True)
-
-        return pdf_path.read_bytes()
+    return office_converter.convert_to_pdf([doc_bytes])[0]
 
 # TXT formatutik testua lortzeko, encoding kasuak kasu
 def _extract_txt_text(file_content: bytes) -> str:
@@ -0,0 +1,109 @@
+"""
+    Persisted FAISS index of each collection, so that it is not rebuilt from the DB on the first query after every restart:
+
+        <INDEX_DIR>/<collection_id>/meta.json                     chunk set version, embedding model, index parameters
+        <INDEX_DIR>/<collection_id>/<version>.faiss               FAISS index, memory-mapped (read-only) on load
+        <INDEX_DIR>/<collection_id>/<version>.docstore.parquet    id and content of the chunk of each index position
+"""
+from backend.config import RAG
+
+import json
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import faiss
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+DOCSTORE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("content", pa.large_string()),
+])
+
+FORMAT = 2  # 2: normalized vectors and inner product metric, index chosen by ann_index
+
+# IO_FLAG_MMAP alone only maps inverted lists; flat indexes need IO_FLAG_MMAP_IFC to map their vectors without copying
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+_lock = threading.Lock()
+
+def _dir(collection_id):
+    return Path(RAG["INDEX_DIR"]) / str(collection_id)
+
+def chunk_set_version(ids):
+    """
+    Version of a set of chunk ids, in the format of db.get_chunk_set_version.
+    """
+    return f"{len(ids)}-{max(ids, default=0)}-{sum(ids)}"
+
+def save(collection_id, index, params, ids, texts):
+    """
+    Persist the index of a collection and its parameters (see ann_index.py), with its docstore sidecar
+    (ids[i] and texts[i] belong to vector i of the index).
+    meta.json is replaced last, so an interrupted save leaves the previous version in use.
+    """
+    if not RAG["INDEX_DIR"]:
+        return
+    version = chunk_set_version(ids)
+    d = _dir(collection_id)
+    with _lock:
+        try:
+            d.mkdir(parents=True, exist_ok=True)
+            faiss.write_index(index, str(d / f"{version}.faiss"))
+            pq.write_table(pa.table([ids, texts], schema=DOCSTORE_SCHEMA), d / f"{version}.docstore.parquet")
+            meta = {
+                "format": FORMAT,
+                "version": version,
+                "vectorizer_id": RAG["VECTORIZER_ID"],
+                "dim": index.d,
+                "ntotal": index.ntotal,
+                "index": params,
+            }
+            tmp_path = d / f"meta.{threading.get_ident()}.tmp"
+            tmp_path.write_text(json.dumps(meta), encoding="utf-8")
+            os.replace(tmp_path, d / "meta.json")
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"Could not persist the index of collection {collection_id}: {e}")
+            return
+        # Files of previous versions (an index that is still mapped stays readable until it is released)
+        for p in d.iterdir():
+            if p.name != "meta.json" and not p.name.startswith(f"{version}."):
+                p.unlink(missing_ok=True)
+    logger.info(f"Persisted the index of collection {collection_id} ({len(ids)} chunks, version {version})")
+
+def load(collection_id, version):
+    """
+    Open the persisted index of a collection as (index, params, ids, texts), with the index memory-mapped.
+    Returns None if there is none, or if it does not match the given chunk set version, the embedding model or the format.
+    """
+    if not RAG["INDEX_DIR"]:
+        return None
+    d = _dir(collection_id)
+    try:
+        meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if meta.get("format") != FORMAT or meta["version"] != version or meta["vectorizer_id"] != RAG["VECTORIZER_ID"]:
+        logger.info(f"The persisted index of collection {collection_id} is stale (version {meta['version']}, current {version})")
+        return None
+    try:
+        index = faiss.read_index(str(d / f"{version}.faiss"), MMAP_FLAGS)
+        table = pq.read_table(d / f"{version}.docstore.parquet")
+    except (OSError, RuntimeError) as e:
+        logger.warning(f"Could not open the persisted index of collection {collection_id}: {e}")
+        return None
+    if index.ntotal != table.num_rows:
+        logger.warning(f"The persisted index of collection {collection_id} does not match its docstore")
+        return None
+    return index, meta["index"], table.column("id").to_pylist(), table.column("content").to_pylist()
+
+def delete(collection_id):
+    if not RAG["INDEX_DIR"]:
+        return
+    with _lock:
+        shutil.rmtree(_dir(collection_id), ignore_errors=True)
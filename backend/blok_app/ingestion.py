@@ -0,0 +1,226 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import backend.blok_app.db as db
+import backend.blok_app.rag as rag
+from backend.blok_app.document_parser_backend_ocr import iter_extract_from_documents
+from backend.blok_app.resource_generation import generate_headings
+from backend.blok_app.uploads import cleanup
+from backend.config import INGESTION, RAG
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("parse", "persist", "embed", "headings")
+
+# Job statuses
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_END = object()  # end of the parsed files queue
+
+jobs = {}
+_jobs_lock = threading.Lock()
+# Each job runs its parse stage in this pool and its persist/embed stage in an extra thread
+executor = ThreadPoolExecutor(max_workers=INGESTION["MAX_JOBS"], thread_name_prefix="ingestion")
+
+def index_new_files(collection_id, uploaded_files, persist=True):
+    """
+    Split and embed only the given newly stored files, skipping those whose content is already indexed in the collection.
+    With persist=False, the collection's index is not saved to disk (see rag.persist_collection).
+    """
+    indexed_hashes = db.get_indexed_content_hashes(collection_id)
+    fids, contents = [], []
+    for f in uploaded_files:
+        if f["content_hash"] in indexed_hashes:
+            logger.info(f"Skipping indexing of {f['filename']}: its content is already indexed in collection {collection_id}")
+            continue
+        indexed_hashes.add(f["content_hash"])
+        fids.append(f["id"])
+        contents.append(f["text"])
+    if not fids:
+        return
+    docs = rag.split_and_vectorize(fids, contents)
+    doc_ids = db.store_documents(docs)
+    rag.add_documents(int(collection_id), docs, doc_ids, persist)
+
+def reindex_collection(collection_id):
+    """
+    Drop every chunk of the collection and index all its files again.
+    """
+    db.delete_collection_documents(collection_id)
+    fids, contents = zip(*[ (f["id"], f["text"]) for f in db.iter_fitxategiak(collection_id, content=True) ])
+    docs = rag.split_and_vectorize(fids, contents)
+    db.store_documents(docs)
+    rag.replace_documents(int(collection_id), db.iter_collection_documents(collection_id))
+
+class IngestionJob:
+    """
+    Background ingestion of a batch of uploaded files into a collection.
+
+    Parsed files are handed over to a second thread that persists and embeds them,
+    so file N is embedded while file N+1 is still being parsed. The collection headings are generated at the end.
+    """
+
+    def __init__(self, collection_id, files):
+        self.id = str(uuid.uuid4())
+        self.collection_id = collection_id
+        self.status = PENDING
+        self.error = ""
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.stages = { stage: {"status": PENDING, "done": 0, "total": len(files)} for stage in STAGES }
+        self.stages["headings"]["total"] = 1
+        self.files = [ {"name": f.name, "stage": PENDING, "status": PENDING, "error": ""} for f in files ]
+        self._uploads = files
+        self._embed_error = None  # raised in run() if the embed thread fails past its files
+        self._lock = threading.Lock()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "collection_id": self.collection_id,
+                "status": self.status,
+                "error": self.error,
+                "stages": { stage: dict(progress) for stage, progress in self.stages.items() },
+                "files": [ dict(f) for f in self.files ],
+                "result": self.result,
+            }
+
+    def _start_stage(self, stage):
+        with self._lock:
+            if self.stages[stage]["status"] == PENDING:
+                self.stages[stage]["status"] = RUNNING
+
+    def _finish_stage(self, stage):
+        with self._lock:
+            self.stages[stage]["status"] = DONE
+
+    def _file_progress(self, idx, stage, status=RUNNING, error=""):
+        with self._lock:
+            self.files[idx].update({"stage": stage, "status": status, "error": error})
+            if status == DONE:
+                self.stages[stage]["done"] += 1
+
+    def run(self, llm):
+        self.status = RUNNING
+        parsed_queue = queue.Queue(maxsize=INGESTION["QUEUE_SIZE"])
+        stored = []
+        consumer = threading.Thread(target=self._persist_and_embed, args=(parsed_queue, stored), name=f"ingestion-{self.id}")
+        consumer.start()
+        try:
+            try:
+                self._parse(parsed_queue)
+            finally:
+                # The files parsed so far are still stored and embedded
+                parsed_queue.put(_END)
+                consumer.join()
+                # Remove the spooled upload files
+                cleanup(self._uploads)
+                self._uploads = None
+            if self._embed_error is not None:
+                raise self._embed_error
+            if not stored:
+                raise Exception("None of the files could be properly read.")
+            if RAG["INDEXING_MODE"] == "full":
+                self._start_stage("embed")
+                reindex_collection(self.collection_id)
+                self._finish_stage("embed")
+            self._headings(llm)
+            self.status = DONE
+        except Exception as e:
+            logger.exception(f"Ingestion job {self.id} failed")
+            self.error = str(e)
+            self.status = FAILED
+        finally:
+            self.finished_at = time.time()
+
+    def _parse(self, parsed_queue):
+        self._start_stage("parse")
+        for idx in range(len(self.files)):
+            self._file_progress(idx, "parse")
+        # Files are handed over as soon as they are parsed (the parser runs each kind of file in its own pool)
+        for idx, parsed in iter_extract_from_documents(self._uploads):
+            if not parsed["success"]:
+                logger.error(f"Ingestion job {self.id}: error parsing {self.files[idx]['name']}: {parsed['error']}")
+                self._file_progress(idx, "parse", FAILED, parsed["error"] or "The file could not be properly read.")
+                continue
+            self._file_progress(idx, "parse", DONE)
+            parsed_queue.put((idx, parsed))
+        self._finish_stage("parse")
+
+    def _persist_and_embed(self, parsed_queue, stored):
+        incremental = RAG["INDEXING_MODE"] != "full"
+        while True:
+            item = parsed_queue.get()
+            if item is _END:
+                break
+            idx, parsed = item
+            try:
+                self._start_stage("persist")
+                self._file_progress(idx, "persist")
+                db.store_fitxategia(self.collection_id, parsed)
+                self._file_progress(idx, "persist", DONE)
+                stored.append(parsed)
+                if incremental:
+                    self._start_stage("embed")
+                    self._file_progress(idx, "embed")
+                    index_new_files(self.collection_id, [parsed], persist=False)
+                    self._file_progress(idx, "embed", DONE)
+            except Exception as e:
+                logger.error(f"Ingestion job {self.id}: error storing {parsed['filename']}: {e}")
+                self._file_progress(idx, self.files[idx]["stage"], FAILED, str(e))
+        self._finish_stage("persist")
+        if incremental:
+            # The index is saved once for the whole job, not once per file
+            try:
+                if stored:
+                    rag.persist_collection(int(self.collection_id))
+            except Exception as e:
+                logger.error(f"Ingestion job {self.id}: error persisting the index: {e}")
+                self._embed_error = e
+                with self._lock:
+                    self.stages["embed"]["status"] = FAILED
+                return
+            self._finish_stage("embed")
+
+    def _headings(self, llm):
+        self._start_stage("headings")
+        files = db.get_fitxategiak(self.collection_id)
+        file_ids = [ f['id'] for f in files ]
+        file_ids_ordered = [ f['id'] for f in sorted(files, key=lambda d: d['name'].lower()) ]
+
+        name, title, summary = generate_headings(llm, db, self.collection_id, file_ids)
+        db.set_descriptors_to_bilduma(self.collection_id, name, title, summary)
+        with self._lock:
+            self.stages["headings"]["done"] = 1
+            self.stages["headings"]["status"] = DONE
+            self.result = {"id": self.collection_id, "title": name, "description": title, "summary": summary, "file_ids": file_ids_ordered, "status": "ok"}
+
+def _purge_finished_jobs():
+    now = time.time()
+    with _jobs_lock:
+        for job_id in [ job_id for job_id, job in jobs.items() if job.finished_at and now - job.finished_at > INGESTION["JOB_TTL"] ]:
+            del jobs[job_id]
+
+def submit(llm, collection_id, files):
+    """
+    Create an ingestion job for the uploaded files and run it in the background.
+    """
+    _purge_finished_jobs()
+    job = IngestionJob(collection_id, files)
+    with _jobs_lock:
+        jobs[job.id] = job
+    executor.submit(job.run, llm)
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return jobs.get(job_id, None)
@@ -0,0 +1,283 @@
+from backend.config import OFFICE
+
+import logging
+import queue
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Python-UNO bridge shipped with LibreOffice (python3-uno)
+    import uno
+except ImportError:
+    uno = None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _prop(name, value):
+    prop = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+class OfficeInstance:
+    """
+    A long-lived headless LibreOffice process accepting UNO connections on a local socket.
+    """
+
+    def __init__(self, port, work_dir):
+        self.port = port
+        self.profile_dir = Path(work_dir) / f"profile-{port}"
+        self.process = None
+        self.desktop = None
+
+    def start(self):
+        self.process = subprocess.Popen([
+            OFFICE["BINARY"],
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--nodefault",
+            "--norestore",
+            "--nolockcheck",
+            f"-env:UserInstallation={self.profile_dir.as_uri()}",
+            f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext",
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.time() + OFFICE["START_TIMEOUT"]
+        while True:
+            try:
+                self._connect()
+                break
+            except Exception as e:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"LibreOffice on port {self.port} exited with code {self.process.returncode}")
+                if time.time() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"LibreOffice on port {self.port} did not start: {e}")
+                time.sleep(0.5)
+        logger.info(f"LibreOffice instance started on port {self.port}")
+
+    def _connect(self):
+        local_ctx = uno.getComponentContext()
+        resolver = local_ctx.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_ctx)
+        ctx = resolver.resolve(f"uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext")
+        self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def kill(self):
+        """
+        Kill a hung process: its pending UNO calls then fail instead of blocking.
+        """
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+    def restart(self):
+        logger.warning(f"Restarting LibreOffice instance on port {self.port}")
+        self.stop()
+        self.start()
+
+    def is_healthy(self):
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getFrames()
+            return True
+        except Exception:
+            return False
+
+    def convert(self, in_path, out_path, filter_name):
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(str(in_path)), "_blank", 0,
+            (_prop("Hidden", True), _prop("ReadOnly", True)),
+        )
+        if doc is None:
+            raise ValueError(f"LibreOffice could not open {in_path.name}")
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(str(out_path)), (_prop("FilterName", filter_name),))
+        finally:
+            doc.close(True)
+
+class OfficeConverterPool:
+    """
+    Pool of persistent LibreOffice instances. Each instance converts one file at a time,
+    so the number of instances caps the concurrent conversions.
+    Without the UNO bridge, every batch is converted by a single `soffice --convert-to` call instead.
+    """
+
+    def __init__(self):
+        self.work_dir = tempfile.mkdtemp(prefix="bloklm-office-", dir=OFFICE["TMP_DIR"])
+        self.use_uno = uno is not None
+        self.instances = queue.Queue()
+        self.all_instances = []
+        self.slots = threading.BoundedSemaphore(OFFICE["INSTANCES"])
+        self.executor = ThreadPoolExecutor(max_workers=OFFICE["INSTANCES"], thread_name_prefix="office")
+        if self.use_uno:
+            try:
+                for port in _free_ports(OFFICE["INSTANCES"]):
+                    instance = OfficeInstance(port, self.work_dir)
+                    try:
+                        instance.start()
+                    finally:
+                        self.all_instances.append(instance)
+                    self.instances.put(instance)
+            except Exception:
+                # Do not leave the instances started so far running
+                self.shutdown()
+                raise
+        else:
+            logger.warning("UNO bridge not available: LibreOffice conversions will start a process per batch")
+
+    def health(self):
+        return [
+            {"port": instance.port, "healthy": instance.is_healthy()}
+            for instance in self.all_instances
+        ]
+
+    def _convert_on(self, instance, in_path, out_path, filter_name):
+        """
+        Convert on the instance, killing it if the conversion takes longer than OFFICE["CONVERT_TIMEOUT"].
+        """
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            instance.kill()
+
+        watchdog = threading.Timer(OFFICE["CONVERT_TIMEOUT"], kill)
+        watchdog.start()
+        try:
+            instance.convert(in_path, out_path, filter_name)
+        except Exception as e:
+            if timed_out.is_set():
+                raise TimeoutError(f"LibreOffice on port {instance.port} timed out converting {in_path.name}") from e
+            raise
+        finally:
+            watchdog.cancel()
+
+    def _convert_one(self, in_path, out_path, filter_name):
+        try:
+            instance = self.instances.get(timeout=OFFICE["CONVERT_TIMEOUT"])
+        except queue.Empty:
+            raise TimeoutError(f"No LibreOffice instance free after {OFFICE['CONVERT_TIMEOUT']}s")
+        try:
+            if not instance.is_healthy():
+                instance.restart()
+            try:
+                self._convert_on(instance, in_path, out_path, filter_name)
+            except TimeoutError:
+                # The killed instance is started again for the next conversion
+                instance.restart()
+                raise
+            except Exception as e:
+                # The instance may have crashed while converting: restart it and retry once
+                if instance.is_healthy():
+                    raise
+                logger.warning(f"LibreOffice instance on port {instance.port} crashed converting {in_path.name}: {e}")
+                instance.restart()
+                self._convert_on(instance, in_path, out_path, filter_name)
+        finally:
+            # Also after a failed restart: the next conversion on it restarts it again
+            self.instances.put(instance)
+        return out_path.read_bytes()
+
+    def _convert_batch_cli(self, in_paths, out_dir, target):
+        with self.slots:
+            subprocess.run([
+                OFFICE["BINARY"],
+                "--headless",
+                f"-env:UserInstallation={(Path(self.work_dir) / 'profile-cli').as_uri()}",
+                "--convert-to", target,
+                "--outdir", str(out_dir),
+                *[ str(p) for p in in_paths ],
+            ], check=True, timeout=OFFICE["CONVERT_TIMEOUT"], stdout=subprocess.DEVNULL)
+        return [ (out_dir / f"{p.stem}.{target}").read_bytes() for p in in_paths ]
+
+    def convert_many(self, files, suffix=".doc", target="pdf", filter_name="writer_pdf_Export"):
+        """
+        Convert a batch of documents (bytes, or paths of files on disk) and return the converted bytes in the same order.
+        """
+        if not files:
+            return []
+        with tempfile.TemporaryDirectory(dir=self.work_dir) as td:
+            tdir = Path(td)
+            in_paths = []
+            for i, file in enumerate(files):
+                in_path = tdir / f"in{i}{suffix}"
+                if isinstance(file, (str, Path)):
+                    shutil.copyfile(file, in_path)
+                else:
+                    in_path.write_bytes(file)
+                in_paths.append(in_path)
+            if not self.use_uno:
+                return self._convert_batch_cli(in_paths, tdir, target)
+            futures = [
+                self.executor.submit(self._convert_one, in_path, tdir / f"{in_path.stem}.{target}", filter_name)
+                for in_path in in_paths
+            ]
+            # Each conversion is bounded by its own timeout (see _convert_one), so none outlives the temp directory
+            return [ future.result() for future in futures ]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for instance in self.all_instances:
+            instance.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+def _free_ports(n):
+    ports = []
+    port = OFFICE["BASE_PORT"]
+    while len(ports) < n:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex(("127.0.0.1", port)) != 0:
+                ports.append(port)
+        port += 1
+    return ports
+
+def get_pool():
+    """
+    Return the process-wide LibreOffice pool, starting its instances on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OfficeConverterPool()
+    return _pool
+
+def convert_to_pdf(files, suffix=".doc"):
+    return get_pool().convert_many(files, suffix=suffix)
+
+def health():
+    with _pool_lock:
+        if _pool is None:
+            return []
+        return _pool.health()
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -0,0 +1,111 @@
+from backend.config import PARSE_CACHE
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_total_bytes = None  # size of the cache dir, computed on first write
+
+stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+}
+
+def make_key(file_chunks, parser, fingerprint):
+    """
+    Content address of a parse result: the file bytes (an iterable of chunks) plus the parser and its configuration.
+    """
+    h = hashlib.sha256()
+    h.update(f"{parser}\0{fingerprint}\0".encode("utf-8"))
+    for chunk in file_chunks:
+        h.update(chunk)
+    return h.hexdigest()
+
+def _path(key):
+    return Path(PARSE_CACHE["DIR"]) / key[:2] / f"{key}.json"
+
+def get(key):
+    """
+    Return the cached parse result for the key, or None. Hits refresh the entry's position in the LRU order.
+    """
+    if not PARSE_CACHE["ENABLED"]:
+        return None
+    path = _path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        os.utime(path)
+    except (OSError, ValueError):
+        with _lock:
+            stats["misses"] += 1
+        return None
+    with _lock:
+        stats["hits"] += 1
+    return result
+
+def put(key, result):
+    """
+    Store a parse result (without its filename, which belongs to the upload) and evict the least recently used entries over the size limit.
+    """
+    global _total_bytes
+    if not PARSE_CACHE["ENABLED"]:
+        return
+    path = _path(key)
+    data = json.dumps({ k: v for k, v in result.items() if k != "filename" }, ensure_ascii=False).encode("utf-8")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            old_size = path.stat().st_size  # overwritten entry
+        except FileNotFoundError:
+            old_size = 0
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write parse cache entry {key}: {e}")
+        return
+    with _lock:
+        if _total_bytes is None:
+            _total_bytes = sum(p.stat().st_size for p in Path(PARSE_CACHE["DIR"]).glob("*/*.json"))
+        else:
+            _total_bytes += len(data) - old_size
+        if _total_bytes > PARSE_CACHE["MAX_BYTES"]:
+            _evict()
+
+def metrics():
+    with _lock:
+        return {
+            "bytes": _total_bytes,  # None until the first write
+            "max_bytes": PARSE_CACHE["MAX_BYTES"],
+            **stats,
+        }
+
+def _evict():
+    global _total_bytes
+    entries = []
+    for p in Path(PARSE_CACHE["DIR"]).glob("*/*.json"):
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    entries.sort()
+    _total_bytes = sum(size for _, size, _ in entries)
+    # Evict down to 90% of the limit, so that the next writes do not trigger a scan each
+    target = PARSE_CACHE["MAX_BYTES"] * 0.9
+    for _, size, p in entries:
+        if _total_bytes <= target:
+            break
+        try:
+            p.unlink()
+        except OSError:
+            continue
+        _total_bytes -= size
+        stats["evictions"] += 1
@@ -1,6 +1,12 @@
-from typing import List
 import asyncio
+import collections
+import concurrent.futures
+import contextlib
 import logging
+import os
+import sqlite3
+import sys
+import threading
 
 from langchain.chat_models import init_chat_model
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -9,29 +15,101 @@ import numpy as np
 import faiss
 from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain.retrievers import ContextualCompressionRetriever
 from langchain.retrievers.document_compressors import CrossEncoderReranker
 from langgraph.graph import MessagesState, StateGraph
 from langchain_core.tools import tool
-from langchain_core.messages import SystemMessage, AIMessage, HumanMessage
+from langchain_core.messages import SystemMessage, AIMessage, HumanMessage, RemoveMessage
 from langgraph.graph import END
 from langgraph.prebuilt import ToolNode, tools_condition
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
 from langchain_core.messages import BaseMessage
 
+from backend.config import RAG
+import backend.blok_app.ann_index as ann_index
+import backend.blok_app.index_store as index_store
+
 logger = logging.getLogger(__name__)
 
 FAISS_FETCH_K = 25
 FAISS_RETRIEVE_K = 5
-THREAD_ID = "default"
+DEFAULT_SESSION = "default"
 MAX_CONTEXT_MSGS = 10  # Number of previous messages (human+ai) to include in context
 MAX_CONTEXT_MSGS_QR = 6  # Number of previous messages (human+system) to include in context for query rewriting
+TOKEN_QUEUE_SIZE = 64  # Tokens produced ahead of the client before the graph waits
 
 embedding_model = None
 reranker_model = None
 llm = None
 
+# The RAG graphs run here, off the event loop: queries to different collections run in parallel
+query_executor = concurrent.futures.ThreadPoolExecutor(max_workers=RAG["QUERY_WORKERS"], thread_name_prefix="rag")
+
+# Conversations of every collection, in threads "<collection_id>:<session>" (see _get_checkpointer)
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
 collection_graphs = {}
+collection_vector_stores = {}
+collection_index_params = {}  # index type and parameters of each loaded collection (see ann_index.py)
+mapped_collections = set()  # collections whose index is memory-mapped from index_store (read-only)
+
+# Loaded collections in LRU order, with their estimated size in bytes, bounded by RAG["CACHE_MAX_BYTES"]
+_cache_sizes = collections.OrderedDict()
+_cache_lock = threading.RLock()
+DOCUMENT_OVERHEAD_BYTES = 600  # Document object, docstore and id map entries of a chunk, besides its text
+
+cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+}
+
+class _RWLock:
+    """
+    Readers-writer lock: many threads may hold it shared, or one exclusive. Waiting writers hold new readers back.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+# Vector store of each collection: searched and read under the shared lock, modified or replaced under the exclusive one
+_store_locks = {}
+
+def _store_lock(collection_id):
+    return _store_locks.setdefault(collection_id, _RWLock())
 
 def split_and_vectorize(fids, contents):
     orig_docs = []
@@ -57,24 +135,7 @@ def split_and_vectorize(fids, contents):
 
     return docs
 
-def _load_vector_store(data: List[dict]):
-    if not data:
-        raise ValueError("No documents provided")
-    ids, texts, embeddings = zip(*[ (doc['id'], doc['content'], doc['emb']) for doc in data ])
-    embedding_dim = len(embeddings[0])
-    collection_id = data[0]["collection_id"]
-
-    index = faiss.IndexFlatL2(embedding_dim)
-    vector_store = FAISS(
-        embedding_function=embedding_model,
-        index=index,
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={},
-    )
-    vector_store.add_embeddings(
-        text_embeddings=zip(texts, embeddings),
-        ids=ids,
-    )
+def _build_retriever(vector_store):
     retriever = vector_store.as_retriever(search_type="similarity", search_kwargs={"k": FAISS_FETCH_K})
 
     # Add reranker
@@ -86,10 +147,248 @@ def _load_vector_store(data: List[dict]):
 
     return compressed_retriever
 
+def _make_vector_store(index, docstore, index_to_docstore_id):
+    # The stored vectors are normalized, so inner product ranks by cosine similarity
+    return FAISS(
+        embedding_function=embedding_model,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
+
+def _load_vector_store(batches):
+    """
+    Build the FAISS store of a collection from column-wise chunk batches (db.iter_collection_documents),
+    adding each batch's normalized embeddings to an exact index as they arrive, which is then replaced by an
+    approximate one if the collection is too large for exact search (ann_index.build).
+    Returns (vector store, index parameters), or (None, None) if there are no chunks.
+    """
+    index = None
+    docstore = InMemoryDocstore()
+    index_to_docstore_id = {}
+    for batch in batches:
+        if index is None:
+            index = faiss.IndexFlatIP(batch["embeddings"].shape[1])
+        index.add(ann_index.normalize(batch["embeddings"]))
+        docstore.add({
+            doc_id: Document(id=doc_id, page_content=text)
+            for doc_id, text in zip(batch["ids"], batch["texts"])
+        })
+        start = len(index_to_docstore_id)
+        index_to_docstore_id.update({ start + i: doc_id for i, doc_id in enumerate(batch["ids"]) })
+    if index is None:
+        return None, None
+    index, params = ann_index.build(index, FAISS_FETCH_K)
+    return _make_vector_store(index, docstore, index_to_docstore_id), params
+
+def _open_vector_store(collection_id, version):
+    """
+    Build the FAISS store of a collection from its persisted index, if it matches the chunk set version.
+    """
+    saved = index_store.load(collection_id, version)
+    if saved is None:
+        return None
+    index, params, ids, texts = saved
+    ann_index.set_search_params(index, params)
+    mapped_collections.add(collection_id)
+    collection_index_params[collection_id] = params
+    return _make_vector_store(
+        index,
+        InMemoryDocstore({ doc_id: Document(id=doc_id, page_content=text) for doc_id, text in zip(ids, texts) }),
+        dict(enumerate(ids)),
+    )
+
+def _persist_vector_store(collection_id, vector_store):
+    with _store_lock(collection_id).shared():
+        ids = [ vector_store.index_to_docstore_id[i] for i in range(vector_store.index.ntotal) ]
+        texts = [ vector_store.docstore.search(doc_id).page_content for doc_id in ids ]
+    index_store.save(collection_id, vector_store.index, collection_index_params[collection_id], ids, texts)
+
+def persist_collection(collection_id):
+    """
+    Persist the index of a loaded collection (e.g. after a series of add_documents with persist=False).
+    """
+    vector_store = collection_vector_stores.get(collection_id, None)
+    if vector_store is not None:
+        _persist_vector_store(collection_id, vector_store)
+
+def add_documents(collection_id, docs, ids, persist=True):
+    """
+    Add newly stored chunks (as returned by split_and_vectorize) to the in-memory index of the collection.
+    Collections that are not loaded yet are skipped: they will read every chunk from the DB when first queried.
+    The index type is kept; it is chosen again for the new size when the collection is next rebuilt.
+    Saving the index rewrites it whole: callers adding in several steps pass persist=False and call persist_collection.
+    """
+    vector_store = collection_vector_stores.get(collection_id, None)
+    if vector_store is None or not docs:
+        return
+    embeddings = ann_index.normalize([ doc["embedding"] for doc in docs ])
+    with _store_lock(collection_id).exclusive():
+        # A load of the collection between storing the chunks and this call has already read them from the DB
+        indexed = set(vector_store.index_to_docstore_id.values())
+        new = [ i for i, doc_id in enumerate(ids) if doc_id not in indexed ]
+        if not new:
+            return
+        if collection_id in mapped_collections:
+            # A memory-mapped index is read-only: copy it to memory before adding to it
+            vector_store.index = faiss.clone_index(vector_store.index)
+            mapped_collections.discard(collection_id)
+        vector_store.add_embeddings(
+            text_embeddings=[ (docs[i]["content"], embeddings[i]) for i in new ],
+            ids=[ ids[i] for i in new ],
+        )
+    logger.info(f"Added {len(new)} chunks to the vector store of collection {collection_id}")
+    if persist:
+        _persist_vector_store(collection_id, vector_store)
+    _cache_put(collection_id, touch=False)
+
+def replace_documents(collection_id, batches):
+    """
+    Replace the in-memory index of a loaded collection, keeping its chat history.
+    """
+    if collection_id not in collection_vector_stores:
+        return
+    vector_store, params = _load_vector_store(batches)
+    if vector_store is None:
+        # No chunks left: unload the collection and its index, but keep its conversations
+        with _cache_lock:
+            _drop(collection_id)
+        index_store.delete(collection_id)
+        return
+    with _store_lock(collection_id).exclusive():
+        mapped_collections.discard(collection_id)
+        collection_index_params[collection_id] = params
+        collection_vector_stores[collection_id] = vector_store
+    _persist_vector_store(collection_id, vector_store)
+    _cache_put(collection_id, touch=False)
+
+# Cache of loaded collections
+
+def _estimate_size(collection_id, vector_store):
+    """
+    Approximate memory held by a loaded collection: its index (unless memory-mapped, as those pages belong to the
+    page cache) plus its chunk texts.
+    """
+    with _store_lock(collection_id).shared():
+        index = vector_store.index
+        params = collection_index_params.get(collection_id, None)  # None if evicted meanwhile
+        size = 0 if collection_id in mapped_collections or params is None else index.ntotal * params["bytes_per_vector"]
+        for doc_id in vector_store.index_to_docstore_id.values():
+            size += sys.getsizeof(vector_store.docstore.search(doc_id).page_content) + DOCUMENT_OVERHEAD_BYTES
+    return size
+
+def _drop(collection_id):
+    collection_graphs.pop(collection_id, None)
+    collection_vector_stores.pop(collection_id, None)
+    collection_index_params.pop(collection_id, None)
+    mapped_collections.discard(collection_id)
+    _cache_sizes.pop(collection_id, None)
+
+def _cache_put(collection_id, touch=True):
+    """
+    (Re)compute the size of a loaded collection, mark it as the most recently used one if touch, and evict the
+    least recently used collections over the memory budget. The most recent one is always kept.
+    """
+    vector_store = collection_vector_stores.get(collection_id, None)
+    if vector_store is None:
+        return
+    # Sized before taking the cache lock, so that a collection being written to does not hold up the others
+    size = _estimate_size(collection_id, vector_store)
+    with _cache_lock:
+        if collection_vector_stores.get(collection_id, None) is not vector_store:
+            return
+        _cache_sizes[collection_id] = size
+        if touch:
+            _cache_sizes.move_to_end(collection_id)
+        total = sum(_cache_sizes.values())
+        while RAG["CACHE_MAX_BYTES"] and total > RAG["CACHE_MAX_BYTES"] and len(_cache_sizes) > 1:
+            evicted, size = next(iter(_cache_sizes.items()))
+            _drop(evicted)
+            total -= size
+            cache_stats["evictions"] += 1
+            logger.info(f"Evicted collection {evicted} ({size / 1024 / 1024:.1f} MB) from the RAG cache")
+
+def get_graph(collection_id):
+    """
+    The RAG graph of a loaded collection, marked as the most recently used one, or None if it is not loaded.
+    """
+    with _cache_lock:
+        graph = collection_graphs.get(collection_id, None)
+        if graph is None:
+            cache_stats["misses"] += 1
+            return None
+        cache_stats["hits"] += 1
+        _cache_sizes.move_to_end(collection_id)
+        return graph
+
+def drop_collection(collection_id):
+    """
+    Forget a deleted collection: its loaded graph and index, its persisted index and its conversations.
+    """
+    with _cache_lock:
+        _drop(collection_id)
+    index_store.delete(collection_id)
+    with _get_checkpointer().cursor() as cur:
+        for table in ("checkpoints", "writes"):
+            cur.execute(f"DELETE FROM {table} WHERE thread_id LIKE ?", (f"{collection_id}:%",))
+
+def cache_metrics():
+    with _cache_lock:
+        return {
+            "collections": len(_cache_sizes),
+            "bytes": sum(_cache_sizes.values()),
+            "max_bytes": RAG["CACHE_MAX_BYTES"],
+            **cache_stats,
+        }
+
+# Conversations
+
+def _get_checkpointer():
+    """
+    SQLite checkpointer shared by the graphs of every collection, so that conversations survive restarts and
+    cache evictions.
+    """
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            os.makedirs(os.path.dirname(RAG["CHECKPOINT_DB"]) or ".", exist_ok=True)
+            _checkpointer = SqliteSaver(sqlite3.connect(RAG["CHECKPOINT_DB"], check_same_thread=False))
+        return _checkpointer
+
+def _thread_config(collection_id, session):
+    return {"configurable": {"thread_id": f"{collection_id}:{session}"}}
+
+def _prune_checkpoints(collection_id, session):
+    """
+    Keep only the latest checkpoint of a conversation: the previous ones are the steps of past queries,
+    with their retrieval contexts.
+    """
+    thread_id = f"{collection_id}:{session}"
+    with _get_checkpointer().cursor() as cur:
+        for table in ("writes", "checkpoints"):
+            cur.execute(
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_id != "
+                "(SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?)",
+                (thread_id, thread_id),
+            )
+
 # RAG graph
     
-def init_collection_graph(collection_id, data):
-    collection_retriever = _load_vector_store(data)
+def init_collection_graph(collection_id, batches, version=None):
+    """
+    Build the RAG graph of a collection. Its index is opened from disk if the persisted one matches the chunk set
+    version (db.get_chunk_set_version); otherwise it is built from the chunk batches (which are then not read) and persisted.
+    """
+    vector_store = _open_vector_store(collection_id, version) if version is not None else None
+    if vector_store is None:
+        vector_store, params = _load_vector_store(batches)
+        if vector_store is None:
+            raise ValueError("No documents provided")
+        mapped_collections.discard(collection_id)
+        collection_index_params[collection_id] = params
+        _persist_vector_store(collection_id, vector_store)
+    collection_vector_stores[collection_id] = vector_store
     graph_builder = StateGraph(MessagesState)
     
     def rewrite_query(state: MessagesState):
@@ -130,8 +429,11 @@ def init_collection_graph(collection_id, data):
         )
         query_text = last_user_message.content if last_user_message else ""
 
-        # Run retrieval
-        retrieved_docs = collection_retriever.get_relevant_documents(query_text)
+        # Run retrieval (the vector store may have been updated or replaced since the graph was built,
+        # or evicted from the cache while this query runs)
+        with _store_lock(collection_id).shared():
+            collection_retriever = _build_retriever(collection_vector_stores.get(collection_id, vector_store))
+            retrieved_docs = collection_retriever.get_relevant_documents(query_text)
         retrieved_text = "\n\n".join(
             (f"Source ID: {doc.id}\nContent: {doc.page_content}")
             for doc in retrieved_docs
@@ -171,36 +473,88 @@ def init_collection_graph(collection_id, data):
         if type(response) == str:
             response = AIMessage(content=response)
         return {"messages": [response]}
+
+    def compact(state: MessagesState):
+        """Drop the rewritten query and retrieved context once answered, and the oldest messages over the limit."""
+        removed = [ m for m in state["messages"] if m.type in ("query_rewriting", "retrieval") ]
+        conversation = [ m for m in state["messages"] if m.type not in ("query_rewriting", "retrieval") ]
+        removed += conversation[:max(0, len(conversation) - RAG["MAX_HISTORY_MSGS"])]
+        return {"messages": [ RemoveMessage(id=m.id) for m in removed ]}
     
     graph_builder.add_node(rewrite_query)
     graph_builder.add_node(retrieve)
     graph_builder.add_node(generate)
+    graph_builder.add_node(compact)
 
     graph_builder.set_entry_point("rewrite_query")
     graph_builder.add_edge("rewrite_query", "retrieve")
     graph_builder.add_edge("retrieve", "generate")
-    graph_builder.add_edge("generate", END)
-
-    collection_graphs[collection_id] = graph_builder.compile(checkpointer=MemorySaver())
-
-async def query(query, collection_id):
-    graph = collection_graphs[collection_id]
-    for msg, metadata in graph.stream(
-        { "messages": [{"role": "user", "content": query}] },
-        stream_mode="messages",
-        config={"configurable": {"thread_id": THREAD_ID}},
-    ):
-        if metadata["langgraph_node"] in ["generate", "query_or_respond"]:
-            if msg.content and msg.type != "retrieval":
-                yield msg.content
-                await asyncio.sleep(0)
-
-def chat_history(collection_id):
-    graph = collection_graphs.get(collection_id, None)
-    if not graph:
-        logging.warning(f"Graph of the collection {collection_id} not found when retrieving chat history")
-        return []
-    state = graph.get_state({"configurable": {"thread_id": THREAD_ID}})
+    graph_builder.add_edge("generate", "compact")
+    graph_builder.add_edge("compact", END)
+
+    graph = graph_builder.compile(checkpointer=_get_checkpointer())
+    collection_graphs[collection_id] = graph
+    _cache_put(collection_id)
+    return graph
+
+async def query(query, collection_id, graph, session=DEFAULT_SESSION):
+    """
+    Stream the answer tokens of the collection's graph (as returned by get_graph or init_collection_graph: it is not
+    looked up again, as it may be evicted from the cache meanwhile). The graph runs in query_executor and hands its tokens over through a bounded queue,
+    so a slow client holds it back; closing this generator (e.g. when the client disconnects) stops the graph
+    at its next streamed message.
+    """
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue(maxsize=TOKEN_QUEUE_SIZE)
+    cancelled = threading.Event()
+    done = object()
+
+    def put(item):
+        # Wait (in the worker thread) for room in the queue, giving up if the consumer is gone
+        future = asyncio.run_coroutine_threadsafe(tokens.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if cancelled.is_set():
+                    future.cancel()
+                    return False
+
+    def produce():
+        try:
+            with contextlib.closing(graph.stream(
+                { "messages": [{"role": "user", "content": query}] },
+                stream_mode="messages",
+                config=_thread_config(collection_id, session),
+            )) as stream:
+                for msg, metadata in stream:
+                    if cancelled.is_set():
+                        logger.info(f"Query to collection {collection_id} cancelled")
+                        return
+                    if metadata["langgraph_node"] in ["generate", "query_or_respond"]:
+                        if msg.content and msg.type != "retrieval":
+                            if not put(msg.content):
+                                return
+            _prune_checkpoints(collection_id, session)
+        except Exception as e:
+            put(e)
+        put(done)
+
+    loop.run_in_executor(query_executor, produce)
+    try:
+        while True:
+            item = await tokens.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+
+def chat_history(collection_id, graph, session=DEFAULT_SESSION):
+    state = graph.get_state(_thread_config(collection_id, session))
     if "messages" not in state.values or not isinstance(state.values["messages"], list):
         logging.warning(f"Graph state of the collection {collection_id} is empty or not valid when retrieving chat history")
         return []
@@ -213,7 +567,5 @@ def chat_history(collection_id):
             })
     return history
 
-def reset_chat(collection_id):
-    graph = collection_graphs.get(collection_id, None)
-    if graph:
-        graph.checkpointer.delete_thread(THREAD_ID)
\ No newline at end of file
+def reset_chat(collection_id, session=DEFAULT_SESSION):
+    _get_checkpointer().delete_thread(f"{collection_id}:{session}")
\ No newline at end of file
@@ -86,19 +86,19 @@ class PromptBuilder:
         )
     
 def retrieve_docs(db, collection_id, file_ids):
-    docs = db.get_fitxategiak(collection_id, content=True, file_ids=file_ids)
-    if not docs:
-        raise ValueError("No content provided")
-    texts = [ doc['text'] for doc in docs ]
-    
     splitter = TokenTextSplitter(
         chunk_size=8192,
         chunk_overlap=500,
         encoding_name="cl100k_base",  # compatible with LLaMA 3.1 tokenizer
     )
+    # Split each file as it is fetched, instead of loading every text first
     docs = []
-    for text in texts:
-        docs.extend(splitter.create_documents([text]))
+    n_files = 0
+    for file in db.iter_fitxategiak(collection_id, content=True, file_ids=file_ids):
+        n_files += 1
+        docs.extend(splitter.create_documents([file['text']]))
+    if not n_files:
+        raise ValueError("No content provided")
     return docs
 
 def create_map_reduce_chain(llm, map_prompt, reduce_prompt, collapse_prompt, output_key="output_text"):
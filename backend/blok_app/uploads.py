@@ -0,0 +1,209 @@
+from backend.config import UPLOADS
+
+import io
+import mimetypes
+import mmap
+import shutil
+import tempfile
+from pathlib import Path
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+from sanic.exceptions import BadRequest
+
+CHUNK_SIZE = 1024 * 1024
+
+class SpooledUpload:
+    """
+    An uploaded file, kept in memory while it is small and spooled to a temporary file (named after the upload) once it
+    grows over UPLOADS["SPOOL_MAX_MEMORY"] bytes. Parsers should use path/open()/mmap() instead of body.
+    """
+
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+        self.size = 0
+        self.path = None
+        self._buffer = io.BytesIO()
+        self._file = None
+        self._dir = None
+
+    def write(self, data):
+        if self._file is None and self.size + len(data) > UPLOADS["SPOOL_MAX_MEMORY"]:
+            self._dir = tempfile.mkdtemp(prefix="bloklm-upload-", dir=UPLOADS["SPOOL_DIR"])
+            self.path = Path(self._dir) / (Path(self.name).name or "upload")
+            self._file = open(self.path, "wb")
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer.write(data)
+        self.size += len(data)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+
+    def open(self):
+        """
+        Return a readable binary file object with the content of the upload.
+        """
+        if self.path is not None:
+            return open(self.path, "rb")
+        return io.BytesIO(self._buffer.getvalue())
+
+    def mmap(self):
+        """
+        Return a read-only buffer with the content of the upload, memory-mapped when it is on disk.
+        """
+        if self.path is None:
+            return self._buffer.getbuffer().toreadonly()
+        if self.size == 0:
+            return b""
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        with self.open() as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    @property
+    def body(self):
+        # Compatibility with Sanic's File: loads the whole file in memory
+        if self.path is not None:
+            return self.path.read_bytes()
+        return self._buffer.getvalue()
+
+    def cleanup(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+            self.path = None
+
+def file_path(file):
+    """
+    Path of the uploaded file on disk, or None if it is only in memory (spooled uploads, Sanic's File).
+    """
+    return getattr(file, "path", None)
+
+def file_source(file):
+    """
+    Path (as str) of the uploaded file when it is on disk, otherwise its bytes.
+    """
+    path = file_path(file)
+    return str(path) if path is not None else file.body
+
+def iter_file_chunks(file, chunk_size=CHUNK_SIZE):
+    if hasattr(file, "iter_chunks"):
+        yield from file.iter_chunks(chunk_size)
+    else:
+        yield file.body
+
+def cleanup(files):
+    for file in files:
+        if hasattr(file, "cleanup"):
+            file.cleanup()
+
+class _MultipartReceiver:
+    """
+    Callbacks of python-multipart's streaming parser: form fields are kept in memory, files are spooled.
+    """
+
+    def __init__(self):
+        self.form = {}
+        self.files = {}
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._part_name = None
+        self._part_file = None
+        self._part_value = None
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._part_name = params.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = params.get(b"filename", None)
+        if filename is None:
+            self._part_file = None
+            self._part_value = bytearray()
+            return
+        filename = filename.decode("utf-8", errors="replace")
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1").strip()
+        if not content_type:
+            content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        self._part_file = SpooledUpload(filename, content_type)
+        self._part_value = None
+
+    def on_part_data(self, data, start, end):
+        if self._part_file is not None:
+            self._part_file.write(data[start:end])
+        else:
+            self._part_value += data[start:end]
+
+    def on_part_end(self):
+        if self._part_file is not None:
+            self._part_file.finish()
+            self.files.setdefault(self._part_name, []).append(self._part_file)
+        else:
+            self.form[self._part_name] = self._part_value.decode("utf-8", errors="replace")
+        self._part_file = None
+        self._part_value = None
+
+async def receive_multipart(request):
+    """
+    Read a multipart/form-data body from a streaming Sanic request, spooling the files as they arrive.
+    Returns (form fields dict, {field name: [SpooledUpload]}).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise BadRequest("A multipart/form-data body is expected")
+
+    receiver = _MultipartReceiver()
+    parser = MultipartParser(params[b"boundary"], receiver.callbacks())
+    try:
+        while True:
+            body = await request.stream.read()
+            if body is None:
+                break
+            parser.write(body)
+        parser.finalize()
+    except Exception:
+        for files in receiver.files.values():
+            cleanup(files)
+        if receiver._part_file is not None:
+            receiver._part_file.cleanup()
+        raise
+    return receiver.form, receiver.files
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -17,6 +18,21 @@ DATABASE = {
     "password": os.getenv("DB_PASSWORD"),
     "host": os.getenv("DB_HOST", "localhost"),
     "port": os.getenv("DB_PORT", "5432"),
+    # Connection pool. Returned connections beyond POOL_MIN idle ones are closed (and their prepared statements lost),
+    # so POOL_MIN defaults to POOL_MAX: every connection opened is kept
+    "POOL_MIN": int(os.getenv("DB_POOL_MIN", os.getenv("DB_POOL_MAX", "10"))),
+    "POOL_MAX": int(os.getenv("DB_POOL_MAX", "10")),
+    "POOL_TIMEOUT": float(os.getenv("DB_POOL_TIMEOUT", "30")),  # max. seconds waiting for a free connection
+    "POOL_CHECK_IDLE": float(os.getenv("DB_POOL_CHECK_IDLE", "30")),  # ping connections idle for longer than this
+    "POOL_MAX_AGE": float(os.getenv("DB_POOL_MAX_AGE", "1800")),  # reopen connections older than this
+    # asyncpg pool used by the request handlers (db_async)
+    "ASYNC_POOL_MIN": int(os.getenv("DB_ASYNC_POOL_MIN", "2")),
+    "ASYNC_POOL_MAX": int(os.getenv("DB_ASYNC_POOL_MAX", "10")),
+    # Statements slower than SLOW_QUERY_MS (0 disables it) are logged, with their EXPLAIN output
+    "SLOW_QUERY_MS": float(os.getenv("DB_SLOW_QUERY_MS", "500")),
+    "SLOW_QUERY_EXPLAIN": os.getenv("DB_SLOW_QUERY_EXPLAIN", "1") == "1",
+    "SLOW_QUERY_EXPLAIN_INTERVAL": float(os.getenv("DB_SLOW_QUERY_EXPLAIN_INTERVAL", "60")),  # min. seconds between EXPLAINs of a statement
+    "SLOW_QUERY_LOG_SIZE": int(os.getenv("DB_SLOW_QUERY_LOG_SIZE", "50")),  # slow queries kept for /api/metrics
 }
 
 # LLM model used for RAG and note generation (summaries, outlines, podcast scripts...)
@@ -31,6 +47,87 @@ RAG = {
     "VECTORIZER_ID": os.getenv("VECTORIZER_ID", "beademiguelperez/sentence-transformers-multilingual-e5-small"),
     "RERANKER_ID": os.getenv("RERANKER_ID", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"),
     "DEVICE": int(os.getenv("RAG_DEVICE", "-1")),
+    # "incremental": only index newly uploaded files; "full": re-index the whole collection on each upload
+    "INDEXING_MODE": os.getenv("RAG_INDEXING_MODE", "incremental"),
+    # Format of the stored chunk embeddings: "float8" (FLOAT8[] column), "float32"/"float16" (packed bytea)
+    # or "pgvector" (needs the vector extension). Convert existing rows with db_utils/migrate_embeddings.py
+    "EMBEDDING_STORAGE": os.getenv("RAG_EMBEDDING_STORAGE", "float8"),
+    # Directory of the persisted FAISS index of each collection (memory-mapped on load); empty to disable.
+    # It must outlive deploys and restarts: set it to a persistent volume when running in a container
+    "INDEX_DIR": os.getenv("RAG_INDEX_DIR", str(BASE_DIR / "data" / "indexes")),
+    # FAISS index of a collection: "auto" uses exact search while it is within SEARCH_LATENCY_MS per query,
+    # then HNSW, then IVF-PQ from IVFPQ_MIN_CHUNKS chunks on; or force "flat", "hnsw" or "ivfpq".
+    # The exact search latency is estimated as chunks * dimension * FLAT_SCAN_NS (not measured, so that the choice is
+    # reproducible): calibrate FLAT_SCAN_NS with the latency_ms recorded in the index meta.json
+    "INDEX_TYPE": os.getenv("RAG_INDEX_TYPE", "auto"),
+    "SEARCH_LATENCY_MS": float(os.getenv("RAG_SEARCH_LATENCY_MS", "20")),
+    "FLAT_SCAN_NS": float(os.getenv("RAG_FLAT_SCAN_NS", "0.25")),
+    "IVFPQ_MIN_CHUNKS": int(os.getenv("RAG_IVFPQ_MIN_CHUNKS", "1000000")),
+    # Recall (against exact search) that efSearch/nprobe are tuned for
+    "ANN_RECALL": float(os.getenv("RAG_ANN_RECALL", "0.95")),
+    # Threads running RAG queries (one query per thread)
+    "QUERY_WORKERS": int(os.getenv("RAG_QUERY_WORKERS", "4")),
+    # SQLite database of the chat conversations, and number of messages (human+ai) kept in each
+    "CHECKPOINT_DB": os.getenv("RAG_CHECKPOINT_DB", str(BASE_DIR / "data" / "chats.sqlite")),
+    "MAX_HISTORY_MSGS": int(os.getenv("RAG_MAX_HISTORY_MSGS", "40")),
+    # Memory budget of the loaded collections (index, chunk texts, graph); least recently used ones are evicted. 0: no limit
+    "CACHE_MAX_BYTES": int(os.getenv("RAG_CACHE_MAX_MB", "4096")) * 1024 * 1024,
+}
+
+# Uploaded files are streamed: kept in memory up to SPOOL_MAX_MEMORY bytes, then spooled to SPOOL_DIR
+UPLOADS = {
+    "SPOOL_MAX_MEMORY": int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY_MB", "8")) * 1024 * 1024,
+    "SPOOL_DIR": os.getenv("UPLOAD_SPOOL_DIR"),  # defaults to the system temp dir
+}
+
+# Document parsing (Docling) parameters
+PARSER = {
+    "DEVICE": os.getenv("PARSER_DEVICE", "cuda"),  # accelerator for the PDF pipeline: "cuda", "cpu" or "auto"
+    "NUM_THREADS": int(os.getenv("PARSER_NUM_THREADS", "8")),
+    "MAX_CONVERSIONS": int(os.getenv("PARSER_MAX_CONVERSIONS", "1")),  # conversions sharing the warm converters at the same time
+    "WARM_UP": os.getenv("PARSER_WARM_UP", "1") == "1",  # load the Docling models at server start
+    # Born-digital PDF pages are read from their text layer; only the pages failing these checks are OCR'd
+    "TEXT_LAYER_FAST_PATH": os.getenv("PARSER_TEXT_LAYER_FAST_PATH", "1") == "1",
+    "TEXT_LAYER_MIN_CHARS": int(os.getenv("PARSER_TEXT_LAYER_MIN_CHARS", "50")),  # non-blank characters
+    "TEXT_LAYER_MIN_COVERAGE": float(os.getenv("PARSER_TEXT_LAYER_MIN_COVERAGE", "0.01")),  # text area / page area
+    "TEXT_LAYER_MAX_GARBAGE": float(os.getenv("PARSER_TEXT_LAYER_MAX_GARBAGE", "0.1")),  # unmapped characters ratio
+    # Large PDFs are split into page ranges converted in a process pool (0 or 1 worker disables it)
+    "PARALLEL_WORKERS": int(os.getenv("PARSER_PARALLEL_WORKERS", "0")),
+    "PARALLEL_MIN_PAGES": int(os.getenv("PARSER_PARALLEL_MIN_PAGES", "40")),
+    "PAGE_RANGE_SIZE": int(os.getenv("PARSER_PAGE_RANGE_SIZE", "16")),
+    "PARALLEL_DEVICE": os.getenv("PARSER_PARALLEL_DEVICE", "cpu"),  # accelerator of each worker's converter
+    "PARALLEL_THREADS": int(os.getenv("PARSER_PARALLEL_THREADS", "2")),  # threads of each worker's converter
+    # Each kind of file is parsed in its own worker pool, so that the kinds overlap: max. concurrent tasks per pool
+    "WORKERS": {
+        "manual": int(os.getenv("PARSER_TEXT_WORKERS", "4")),  # TXT/SRT, one task per file
+        "doc": int(os.getenv("PARSER_DOC_WORKERS", "2")),  # .doc, one task per upload batch
+        "ocr": int(os.getenv("PARSER_OCR_WORKERS", "1")),  # PDF/DOCX, one task per file
+        "audio": int(os.getenv("PARSER_AUDIO_WORKERS", "1")),  # ASR, one task per file
+    },
+}
+
+# Disk cache of extracted texts, keyed by file content and parser configuration
+PARSE_CACHE = {
+    "ENABLED": os.getenv("PARSE_CACHE_ENABLED", "1") == "1",
+    "DIR": os.getenv("PARSE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "bloklm-parse-cache")),
+    "MAX_BYTES": int(os.getenv("PARSE_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+}
+
+# LibreOffice conversion service (fallback for the .doc files the native reader cannot handle)
+OFFICE = {
+    "BINARY": os.getenv("OFFICE_BINARY", "soffice"),
+    "INSTANCES": int(os.getenv("OFFICE_INSTANCES", "2")),  # persistent processes, i.e. max. concurrent conversions
+    "BASE_PORT": int(os.getenv("OFFICE_BASE_PORT", "2002")),  # first local UNO port to try
+    "START_TIMEOUT": int(os.getenv("OFFICE_START_TIMEOUT", "60")),
+    "CONVERT_TIMEOUT": int(os.getenv("OFFICE_CONVERT_TIMEOUT", "300")),
+    "TMP_DIR": os.getenv("OFFICE_TMP_DIR"),  # defaults to the system temp dir
+}
+
+# Background ingestion of uploaded files (parse, persist, chunk/embed, headings)
+INGESTION = {
+    "MAX_JOBS": int(os.getenv("INGESTION_MAX_JOBS", "2")),  # ingestion jobs running at the same time
+    "QUEUE_SIZE": int(os.getenv("INGESTION_QUEUE_SIZE", "4")),  # parsed files waiting to be embedded
+    "JOB_TTL": int(os.getenv("INGESTION_JOB_TTL", "3600")),  # seconds a finished job stays queryable
 }
 
 # ASR parameters
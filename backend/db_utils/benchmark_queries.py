@@ -0,0 +1,178 @@
+"""
+Benchmark the endpoint queries on synthetic data, before and after the lookup indexes migration.
+
+Each scale (COLLECTIONSxFILESxCHUNKS, e.g. 100x10x20) is seeded in a scratch schema that is dropped at the end,
+so the application tables are not touched. For every query, the median and p95 latency and the EXPLAIN ANALYZE
+plan are reported.
+
+    python benchmark_queries.py --scales 10x5x10,100x10x20 --repeat 20
+"""
+import argparse
+import random
+import statistics
+import time
+import sys
+sys.path.insert(0, "../../")
+from create_tables import connect, create_tables, apply_migrations
+
+SCHEMA = "bloklm_bench"
+INDEXES_VERSION = 3  # migrations/0003_lookup_indexes.sql
+EMBEDDING_DIM = 384
+
+# Endpoint queries, as run by backend/blok_app/db.py. Modifying ones are rolled back.
+QUERIES = {
+    "get_bildumak": (
+        "SELECT B.id, B.name, B.title, B.summary, B.create_date::TEXT AS c_date, B.update_date::TEXT AS u_date, COUNT(F.id) AS fitxategia_count "
+        "FROM Bilduma as B LEFT JOIN Fitxategia AS F ON F.bilduma_key = B.id GROUP BY B.id, B.name, B.create_date, B.update_date",
+        lambda ids: (),
+    ),
+    "get_bilduma": (
+        "SELECT id, name, title, summary, create_date::TEXT AS c_date, update_date::TEXT AS u_date FROM Bilduma WHERE id = %s",
+        lambda ids: (ids["collection"],),
+    ),
+    "get_fitxategiak": (
+        "SELECT id, name, format FROM Fitxategia WHERE bilduma_key = %s",
+        lambda ids: (ids["collection"],),
+    ),
+    "get_fitxategiak(content=True)": (
+        "SELECT id, name, format, text FROM Fitxategia WHERE bilduma_key = %s",
+        lambda ids: (ids["collection"],),
+    ),
+    "get_indexed_content_hashes": (
+        "SELECT DISTINCT f.content_hash AS content_hash FROM Fitxategia AS f "
+        "WHERE f.bilduma_key = %s AND f.content_hash IS NOT NULL "
+        "AND EXISTS (SELECT 1 FROM Document AS doc WHERE doc.file_id = f.id)",
+        lambda ids: (ids["collection"],),
+    ),
+    "retrieve_collection_documents": (
+        "SELECT doc.id, doc.content, doc.embedding FROM Document AS doc "
+        "INNER JOIN Fitxategia as f ON doc.file_id = f.id WHERE f.bilduma_key=%s ORDER BY doc.id",
+        lambda ids: (ids["collection"],),
+    ),
+    "get_document": (
+        "SELECT doc.id as id, doc.content as text, doc.start_index as offset, file.id as file_id, file.name as file_title, file.text as file_text "
+        "FROM Document as doc INNER JOIN Fitxategia as file ON doc.file_id = file.id WHERE doc.id=%s",
+        lambda ids: (ids["document"],),
+    ),
+    "get_notes": (
+        "SELECT id, status, name, content, type, contained_file_ids, created_at::TEXT AS created_at FROM Note WHERE bilduma_key = %s",
+        lambda ids: (ids["collection"],),
+    ),
+    "delete_collection_documents": (
+        "DELETE FROM Document AS doc USING Fitxategia AS f WHERE doc.file_id = f.id AND f.bilduma_key = %s",
+        lambda ids: (ids["collection"],),
+    ),
+    "delete_bilduma (cascade)": (
+        "DELETE FROM Bilduma WHERE id = %s",
+        lambda ids: (ids["collection"],),
+    ),
+}
+
+def parse_scale(scale):
+    collections, files, chunks = ( int(n) for n in scale.lower().split("x") )
+    return collections, files, chunks
+
+def seed(conn, collections, files, chunks):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO Bilduma (id, name, create_date, update_date) "
+            "SELECT g, 'Bench ' || g, CURRENT_DATE, CURRENT_DATE FROM generate_series(1, %s) AS g",
+            (collections,),
+        )
+        cur.execute(
+            "INSERT INTO Fitxategia (name, text, charNum, format, content_hash, bilduma_key) "
+            "SELECT 'file_' || f || '.txt', repeat('lorem ipsum dolor sit amet ', 400), 10800, 'TXT', "
+            "md5(b || '-' || f) || md5(f || '-' || b), b "
+            "FROM generate_series(1, %s) AS b, generate_series(1, %s) AS f",
+            (collections, files),
+        )
+        cur.execute(
+            "INSERT INTO Note (status, name, type, content, bilduma_key) "
+            "SELECT 1, 'Summary ' || n, 'summary', repeat('lorem ipsum ', 200), b "
+            "FROM generate_series(1, %s) AS b, generate_series(1, 5) AS n",
+            (collections,),
+        )
+        cur.execute(
+            "INSERT INTO Document (content, embedding, start_index, file_id) "
+            "SELECT repeat('lorem ipsum dolor sit amet ', 70), "
+            "(SELECT array_agg(random()) FROM generate_series(1, %s)), (c - 1) * 1800, f.id "
+            "FROM Fitxategia AS f, generate_series(1, %s) AS c",
+            (EMBEDDING_DIM, chunks),
+        )
+        cur.execute("SELECT MIN(id), MAX(id) FROM Document")
+        doc_range = cur.fetchone()
+    conn.commit()
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE")
+    conn.commit()
+    return doc_range
+
+def run_queries(conn, collections, doc_range, repeat):
+    results = {}
+    for name, (sql, make_args) in QUERIES.items():
+        latencies = []
+        plan = None
+        for i in range(repeat):
+            ids = {"collection": random.randint(1, collections), "document": random.randint(*doc_range)}
+            with conn.cursor() as cur:
+                start = time.perf_counter()
+                cur.execute(sql, make_args(ids))
+                if cur.description is not None:
+                    cur.fetchall()
+                latencies.append((time.perf_counter() - start) * 1000)
+                if i == 0:
+                    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, make_args(ids))
+                    plan = "\n".join( row[0] for row in cur.fetchall() )
+            conn.rollback()
+        latencies.sort()
+        results[name] = {
+            "median_ms": statistics.median(latencies),
+            "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "plan": plan,
+        }
+    return results
+
+def report(title, results, show_plans):
+    print(f"\n=== {title}")
+    print(f"{'query':<32} {'median ms':>10} {'p95 ms':>10}")
+    for name, res in results.items():
+        print(f"{name:<32} {res['median_ms']:>10.2f} {res['p95_ms']:>10.2f}")
+    if show_plans:
+        for name, res in results.items():
+            print(f"\n--- {name}\n{res['plan']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="10x5x10,50x10x20,100x20x20", help="comma-separated COLLECTIONSxFILESxCHUNKS")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-plans", action="store_true", help="only print the latencies")
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        for scale in args.scales.split(","):
+            collections, files, chunks = parse_scale(scale)
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+                cur.execute(f"CREATE SCHEMA {SCHEMA}")
+                cur.execute(f"SET search_path TO {SCHEMA}")
+            conn.commit()
+
+            create_tables(conn)
+            apply_migrations(conn, target=INDEXES_VERSION - 1)
+            start = time.perf_counter()
+            doc_range = seed(conn, collections, files, chunks)
+            print(f"\nSeeded {collections} collections x {files} files x {chunks} chunks in {time.perf_counter() - start:.1f}s")
+
+            report(f"{scale}: without lookup indexes", run_queries(conn, collections, doc_range, args.repeat), not args.no_plans)
+            apply_migrations(conn)
+            with conn.cursor() as cur:
+                cur.execute("ANALYZE")
+            conn.commit()
+            report(f"{scale}: with lookup indexes", run_queries(conn, collections, doc_range, args.repeat), not args.no_plans)
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
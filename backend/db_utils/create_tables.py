@@ -2,27 +2,80 @@ import psycopg2
 import sys
 sys.path.insert(0, "../../")
 from backend.config import DATABASE
+import argparse
 import os
+import re
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 sql_fpath = os.path.join(script_dir, "create_tables.sql")
+migrations_dir = os.path.join(script_dir, "migrations")
 
-# Read the SQL schema from file
-with open(sql_fpath, "r") as f:
-    sql = f.read()
-
-# Connect to the database
-conn = psycopg2.connect(
-    dbname=DATABASE["name"],
-    user=DATABASE["user"],
-    password=DATABASE["password"],
-    host=DATABASE["host"],
-    port=DATABASE["port"]
-)
-
-cur = conn.cursor()
-cur.execute(sql)
-conn.commit()
-cur.close()
-conn.close()
-print("✅ Tables created successfully.")
\ No newline at end of file
+def list_migrations():
+    """
+    Numbered migrations in migrations/ (NNNN_description.sql), as sorted (version, name, path) tuples.
+    """
+    migrations = []
+    for fname in os.listdir(migrations_dir):
+        match = re.match(r"^(\d+)_(.+)\.sql$", fname)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(migrations_dir, fname)))
+    return sorted(migrations)
+
+def create_tables(conn):
+    # Read the SQL schema from file
+    with open(sql_fpath, "r") as f:
+        sql = f.read()
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+    conn.commit()
+
+def current_version(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cur.fetchone()[0]
+
+def apply_migrations(conn, target=None):
+    """
+    Apply, in order and each in its own transaction, the migrations newer than the recorded schema version
+    (up to target, if given). Returns the list of applied versions.
+    """
+    version = current_version(conn)
+    applied = []
+    for number, name, path in list_migrations():
+        if number <= version or (target is not None and number > target):
+            continue
+        with open(path, "r") as f:
+            sql = f.read()
+        with conn.cursor() as cur:
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (number, name))
+        conn.commit()
+        print(f"Applied migration {number:04d}_{name}")
+        applied.append(number)
+    return applied
+
+def connect():
+    return psycopg2.connect(
+        dbname=DATABASE["name"],
+        user=DATABASE["user"],
+        password=DATABASE["password"],
+        host=DATABASE["host"],
+        port=DATABASE["port"]
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the tables and apply the pending schema migrations.")
+    parser.add_argument("--target", type=int, default=None, help="migrate up to this version (default: latest)")
+    args = parser.parse_args()
+
+    # Connect to the database
+    conn = connect()
+    create_tables(conn)
+    apply_migrations(conn, args.target)
+    version = current_version(conn)
+    conn.close()
+    print(f"✅ Tables created successfully (schema version {version}).")
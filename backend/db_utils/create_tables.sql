@@ -16,6 +16,7 @@ CREATE TABLE IF NOT EXISTS Fitxategia (
     text TEXT,
     charNum INTEGER,
     format VARCHAR(10) CHECK (format IN ('PDF', 'TXT', 'DOC', 'DOCX', 'SRT', 'MP3', 'WAV')),
+    content_hash CHAR(64),
     bilduma_key BIGINT REFERENCES Bilduma(id) ON DELETE CASCADE
 );
 
@@ -35,7 +36,8 @@ CREATE TABLE IF NOT EXISTS Note (
 CREATE TABLE IF NOT EXISTS Document (
     id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
     content TEXT NOT NULL,
-    embedding FLOAT8[] NOT NULL,
+    embedding FLOAT8[],
+    embedding_blob BYTEA,
     start_index INTEGER NOT NULL,
     file_id BIGINT NOT NULL REFERENCES Fitxategia (id) ON DELETE CASCADE
-);
\ No newline at end of file
+);
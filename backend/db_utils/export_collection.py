@@ -0,0 +1,17 @@
+"""
+Export a collection (texts, chunks, embeddings and notes) to a bundle directory.
+
+    python export_collection.py <collection_id> <bundle_dir>
+"""
+import argparse
+import sys
+sys.path.insert(0, "../../")
+from backend.blok_app.collection_bundle import export_collection
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("collection_id", type=int)
+parser.add_argument("bundle_dir")
+args = parser.parse_args()
+
+manifest = export_collection(args.collection_id, args.bundle_dir)
+print(f"✅ Exported {manifest['files']} files, {manifest['chunks']} chunks and {manifest['notes']} notes to {args.bundle_dir}.")
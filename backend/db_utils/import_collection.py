@@ -0,0 +1,19 @@
+"""
+Import a collection bundle (see export_collection.py) as a new collection.
+
+    python import_collection.py <bundle_dir> [--id ID] [--name NAME]
+"""
+import argparse
+import sys
+sys.path.insert(0, "../../")
+from backend.blok_app.collection_bundle import import_collection
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("bundle_dir")
+parser.add_argument("--id", type=int, default=None, help="id of the new collection (default: current time in ms)")
+parser.add_argument("--name", default=None, help="name of the new collection (default: the exported one)")
+parser.add_argument("--allow-model-mismatch", action="store_true", help="import embeddings computed with another vectorizer")
+args = parser.parse_args()
+
+collection_id = import_collection(args.bundle_dir, args.id, args.name, args.allow_model_mismatch)
+print(f"✅ Bundle imported as collection {collection_id}.")
@@ -0,0 +1,86 @@
+"""
+Convert the stored chunk embeddings of the Document table to another storage format.
+
+    python migrate_embeddings.py --to float32 [--from float8] [--clear-source]
+
+Set RAG_EMBEDDING_STORAGE to the new format once the migration is done.
+"""
+import argparse
+import psycopg2
+import psycopg2.extras
+import sys
+sys.path.insert(0, "../../")
+from backend.config import DATABASE
+from backend.blok_app.db import EMBEDDING_COLUMNS, EMBEDDING_SELECT, embedding_matrix, pack_embedding
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--from", dest="source", choices=EMBEDDING_COLUMNS.keys(), default="float8")
+parser.add_argument("--to", dest="target", choices=EMBEDDING_COLUMNS.keys(), required=True)
+parser.add_argument("--batch-size", type=int, default=2000)
+parser.add_argument("--clear-source", action="store_true", help="set the source column to NULL once converted")
+args = parser.parse_args()
+
+if EMBEDDING_COLUMNS[args.source] == EMBEDDING_COLUMNS[args.target]:
+    sys.exit(f"{args.source} and {args.target} are stored in the same column")
+
+conn = psycopg2.connect(
+    dbname=DATABASE["name"],
+    user=DATABASE["user"],
+    password=DATABASE["password"],
+    host=DATABASE["host"],
+    port=DATABASE["port"]
+)
+cur = conn.cursor()
+
+# Columns of the storage formats
+cur.execute("ALTER TABLE Document ALTER COLUMN embedding DROP NOT NULL")
+cur.execute("ALTER TABLE Document ADD COLUMN IF NOT EXISTS embedding_blob BYTEA")
+if "pgvector" in (args.source, args.target):
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    cur.execute("ALTER TABLE Document ADD COLUMN IF NOT EXISTS embedding_vec vector")
+conn.commit()
+
+source_col = EMBEDDING_COLUMNS[args.source]
+target_col = EMBEDDING_COLUMNS[args.target]
+if args.target == "pgvector":
+    template = "(%s, %s::FLOAT4[]::vector)"
+elif args.target == "float8":
+    template = "(%s, %s::FLOAT8[])"
+else:
+    template = "(%s, %s::BYTEA)"
+
+last_id = 0
+converted = 0
+while True:
+    # Keyset pagination over the rows still to convert
+    cur.execute(
+        f"SELECT doc.id, {EMBEDDING_SELECT[args.source]} FROM Document AS doc "
+        f"WHERE doc.id > %s AND doc.{source_col} IS NOT NULL ORDER BY doc.id LIMIT %s",
+        (last_id, args.batch_size),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        break
+    ids = [ row[0] for row in rows ]
+    matrix = embedding_matrix([ row[1] for row in rows ], args.source)
+    if args.target in ("float8", "pgvector"):
+        values = [ vector.tolist() for vector in matrix ]
+    else:
+        values = [ psycopg2.Binary(pack_embedding(vector, args.target)) for vector in matrix ]
+    psycopg2.extras.execute_values(
+        cur,
+        f"UPDATE Document AS doc SET {target_col} = v.emb FROM (VALUES %s) AS v(id, emb) WHERE doc.id = v.id",
+        list(zip(ids, values)),
+        template=template,
+        page_size=args.batch_size,
+    )
+    if args.clear_source:
+        cur.execute(f"UPDATE Document SET {source_col} = NULL WHERE id = ANY(%s)", (ids,))
+    conn.commit()
+    last_id = ids[-1]
+    converted += len(ids)
+    print(f"Converted {converted} embeddings")
+
+cur.close()
+conn.close()
+print(f"✅ {converted} embeddings converted from {args.source} to {args.target}.")
@@ -0,0 +1,2 @@
+-- Content hash of the file text, used to skip re-indexing files already in a collection
+ALTER TABLE Fitxategia ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
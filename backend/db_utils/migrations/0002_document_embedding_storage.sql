@@ -0,0 +1,3 @@
+-- Embeddings can be stored packed in embedding_blob (or in a pgvector column, see migrate_embeddings.py)
+ALTER TABLE Document ALTER COLUMN embedding DROP NOT NULL;
+ALTER TABLE Document ADD COLUMN IF NOT EXISTS embedding_blob BYTEA;
@@ -0,0 +1,5 @@
+-- Foreign keys filtered on by the endpoint queries (and scanned by ON DELETE CASCADE).
+-- content_hash is included so that get_indexed_content_hashes is answered from the index.
+CREATE INDEX IF NOT EXISTS fitxategia_bilduma_key_idx ON Fitxategia (bilduma_key, content_hash);
+CREATE INDEX IF NOT EXISTS document_file_id_idx ON Document (file_id);
+CREATE INDEX IF NOT EXISTS note_bilduma_key_idx ON Note (bilduma_key);
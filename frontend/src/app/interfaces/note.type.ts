@@ -1,7 +1,8 @@
 export interface Note {
   id: string;
   name: string;
-  content: string;
+  content: string;     // empty in the note list until the note is opened
+  content_size?: number;
   type: string;
   status: number; // Changed from boolean to number (0, 1, or 2)
   created_at?: Date;  // Optional: for displaying time left
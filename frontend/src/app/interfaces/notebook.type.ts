@@ -3,6 +3,7 @@ export interface Notebook {
   title: string
   description?: string
   summary?: string
+  summarySize?: number  // set by the notebook list, which does not include the summary
   createdAt: Date
   updatedAt: Date
   sourceCount: number
@@ -13,7 +14,8 @@ export interface BackendNotebook {
   id: number;          // number in backend
   name: string;        // becomes notebook title
   title:string;         // For chat title
-  summary: string;      // summary of notebook files
+  summary?: string;     // summary of notebook files (only in the single notebook response)
+  summary_size?: number; // summary length, in the notebook list
   c_date: string;        // ISO date string
   u_date: string;        // ISO date string
   fitxategia_count: number; // becomes sourceCount
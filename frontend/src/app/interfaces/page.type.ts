@@ -0,0 +1,5 @@
+// Keyset-paginated list returned by the backend: request the next page with ?after=<next>
+export interface Page<T> {
+  items: T[]
+  next: number | null
+}
@@ -32,15 +32,29 @@ export class ChatService {
   // Track citations in current message
   private citationMap: Map<string, number> = new Map();
 
+  // Conversation thread of this browser in the backend (one per collection)
+  private static readonly SESSION_KEY = 'bloklm_chat_session';
+
   constructor(private notebookService: NotebookService, private http: HttpClient) {
 
     this.currentNtId = this.route.snapshot.paramMap.get('id') || null
   }
 
 
+  private getSessionId(): string {
+    let session = localStorage.getItem(ChatService.SESSION_KEY);
+    if (!session) {
+      // crypto.randomUUID is only available in secure contexts (HTTPS); getRandomValues also works over HTTP
+      const bytes = crypto.getRandomValues(new Uint8Array(16));
+      session = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+      localStorage.setItem(ChatService.SESSION_KEY, session);
+    }
+    return session;
+  }
+
   loadChat(id: string): void {
 
-    this.call_backend('get_chat', 'GET', {nt_id: id}, undefined).subscribe({
+    this.call_backend('get_chat', 'GET', {nt_id: id, session: this.getSessionId()}, undefined).subscribe({
       next: (chat) => {
         const newChat = this.convertChatElement(chat);
         this.currentChatSubject.next(newChat);
@@ -174,7 +188,8 @@ export class ChatService {
         },
         body: JSON.stringify({ 
           query: userMessage,
-          collection: nb ? nb.id : ''
+          collection: nb ? nb.id : '',
+          session: this.getSessionId()
         })
       });
 
@@ -306,12 +321,13 @@ export class ChatService {
   // Utility methods
   clearAllData(): void {
     try {
+      const session = this.getSessionId();
       localStorage.clear();
       this.resetCitationMap()
       this.currentChatSubject.next({title: this.currentChatSubject.value?.title || '', messages: []});
       this.isGeneratingSubject.next(false);
 
-      this.call_backend('delete_chat', 'GET', {nt_id: this.notebookService.getCurrentId() || ''}, undefined).subscribe(()=>{
+      this.call_backend('delete_chat', 'GET', {nt_id: this.notebookService.getCurrentId() || '', session}, undefined).subscribe(()=>{
         console.log('Chat deleted in backend!');
       })
     } catch (error) {
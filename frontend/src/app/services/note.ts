@@ -1,6 +1,7 @@
 import { inject, Injectable, OnDestroy, NgZone } from '@angular/core';
 import { Note, NoteParameters } from '../interfaces/note.type';
-import { BehaviorSubject, Observable, tap, finalize, interval, switchMap, takeWhile, catchError, of, EMPTY, throwError } from 'rxjs';
+import { BehaviorSubject, Observable, tap, finalize, interval, switchMap, takeWhile, catchError, of, EMPTY, throwError, expand, reduce, map } from 'rxjs';
+import { Page } from '../interfaces/page.type';
 import { HttpClient } from '@angular/common/http';
 import { environment } from '../../environments/environment';
 import { NotebookService } from './notebook';
@@ -18,7 +19,22 @@ export class NoteService implements OnDestroy{
   public note$ = this.noteSubject.asObservable();
 
   open(note: Note) {
-    this.noteSubject.next(note);
+    // The note list has no contents: fetch the full note when it is opened
+    if (note.status !== 1 || note.content) {
+      this.noteSubject.next(note);
+      return;
+    }
+    this.call_backend<Partial<Note>>('note', 'GET', { id: note.id }, undefined).subscribe({
+      next: (full) => {
+        const openedNote = { ...note, ...full, id: note.id, audioData: note.audioData, audioUrl: note.audioUrl };
+        this.notesSubject.next(this.notesSubject.value.map(n => n.id === note.id ? { ...n, content: openedNote.content } : n));
+        this.noteSubject.next(openedNote);
+      },
+      error: (error) => {
+        console.error(`Error loading note ${note.id}:`, error);
+        this.noteSubject.next(note);
+      }
+    });
   }
 
   close() {
@@ -115,7 +131,7 @@ export class NoteService implements OnDestroy{
       return;
     }
 
-    this.call_backend<Note[]>('notes', 'GET', { nt_id: notebookId }, undefined)
+    this.loadAllNotes(notebookId)
       .subscribe({
         next: (notes) => {
           // First, set the notes without audio data
@@ -166,6 +182,18 @@ export class NoteService implements OnDestroy{
       });
   }
 
+  // Follow the keyset pages of the note list (metadata only)
+  private loadAllNotes(notebookId: string): Observable<Note[]> {
+    const fetchPage = (after: number | null) => this.call_backend<Page<Note>>(
+      'notes', 'GET', after === null ? { nt_id: notebookId } : { nt_id: notebookId, after: after }, undefined
+    );
+    return fetchPage(null).pipe(
+      expand(page => page.next === null ? EMPTY : fetchPage(page.next)),
+      reduce((notes: Note[], page: Page<Note>) => notes.concat(page.items), []),
+      map(notes => notes.map(note => ({ ...note, content: note.content ?? '' })))
+    );
+  }
+
   private startPolling(noteId: string) {
     // Avoid duplicate polling for the same note
     if (this.pollingIntervals.has(noteId)) {
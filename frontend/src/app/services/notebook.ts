@@ -1,10 +1,11 @@
 import { Injectable, signal } from "@angular/core"
 import { HttpClient, HttpErrorResponse } from "@angular/common/http"
 import { firstValueFrom, map } from 'rxjs';
-import { type Observable, of } from "rxjs"
+import { type Observable, of, timer, switchMap, filter, take } from "rxjs"
 import { environment } from '../../environments/environment';
 import{Notebook ,BackendNotebook} from '../interfaces/notebook.type';
 import{Source, BackendSource} from '../interfaces/source.type';
+import { Page } from '../interfaces/page.type';
 import { I18nService } from "./i18n";
 import { Form } from "@angular/forms";
 
@@ -140,9 +141,9 @@ export class NotebookService {
     // sources
     await this.loadSourcesForNotebook(id);
 
-    // if already in memory, return it
+    // if already in memory (with its summary, which the notebook list does not include), return it
     let notebook = this.notebooks().find(n => n.id === id);
-    if (notebook) {
+    if (notebook && (notebook.summary !== undefined || !notebook.summarySize)) {
       this.currentNotebook.set(notebook);
       return notebook;
     }
@@ -151,7 +152,8 @@ export class NotebookService {
     const raw$ = this.call_backend('bilduma', 'GET', { id }, undefined);
     const data = await firstValueFrom(raw$);
 
-    notebook = this.convertBackendNotebook(data);
+    notebook = { ...notebook, ...this.convertBackendNotebook(data) };
+    this.notebooks.update(notebooks => notebooks.map(n => n.id === id ? notebook! : n));
     this.currentNotebook.set(notebook);
     return notebook;
   }
@@ -176,10 +178,17 @@ export class NotebookService {
   }
 
   private async loadNotebooks() {
-    const raw$ = this.call_backend('bildumak', 'GET', {}, undefined);
-    const raw_notebooks = await firstValueFrom(raw$);
-
-    const converted_notebooks: Notebook[] = (raw_notebooks as BackendNotebook[]).map(this.convertBackendNotebook);
+    // Follow the keyset pages of the notebook list (metadata only)
+    const raw_notebooks: BackendNotebook[] = [];
+    let after: number | null = null;
+    do {
+      const raw$ = this.call_backend('bildumak', 'GET', after === null ? {} : { after: after }, undefined);
+      const page = await firstValueFrom(raw$) as Page<BackendNotebook>;
+      raw_notebooks.push(...page.items);
+      after = page.next;
+    } while (after !== null);
+
+    const converted_notebooks: Notebook[] = raw_notebooks.map(this.convertBackendNotebook);
 
     this.notebooks.set(converted_notebooks);
   }
@@ -190,6 +199,7 @@ export class NotebookService {
       title: b.name,
       description: b.title,
       summary: b.summary,
+      summarySize: b.summary_size,
       createdAt: new Date(b.c_date),
       updatedAt: new Date(b.u_date),
       sourceCount: b.fitxategia_count,
@@ -257,7 +267,20 @@ export class NotebookService {
   uploadFilesToBackend(notebookId: string, formData: FormData): Observable<any> {
     // 'upload_files' becomes the <id> segment in the final URL
     formData.append('nt_id', notebookId);
-    return this.call_backend('igo_fitxategiak', 'POST', undefined, formData);
+    // The backend ingests the files in a background job: poll it until it finishes
+    return this.call_backend('igo_fitxategiak', 'POST', undefined, formData).pipe(
+      switchMap((job: any) => timer(0, 3000).pipe(
+        switchMap(() => this.call_backend('ingestion_job', 'GET', { id: job.job_id }, undefined)),
+        filter((status: any) => status.status === 'done' || status.status === 'failed'),
+        take(1),
+      )),
+      map((status: any) => {
+        if (status.status === 'failed') {
+          throw new Error(status.error)
+        }
+        return status.result
+      })
+    );
   }
 
   private call_backend(